@@ -1,32 +1,55 @@
-import google.generativeai as genai
 import toml
 from PIL import Image
 import io
 import json
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import signature_cache
+import model_client
+
+MODEL_NAME = "gemini-flash-latest"
 
 def initialize_ai():
-    """Configura la API de Gemini desde secrets.toml."""
+    """
+    Configura la API de Gemini desde secrets.toml.
+    Solo registra la clave: el SDK se importa con la primera llamada al modelo.
+    """
+    if model_client.MODEL_BACKEND == "fake":
+        return True # Backend simulado: no hace falta API key
     try:
         secrets = toml.load(".streamlit/secrets.toml")
         api_key = secrets["general"]["gemini_api_key"]
-        genai.configure(api_key=api_key)
+        model_client.configure_gemini(api_key)
         return True
     except Exception as e:
         print(f"Error AI Init: {e}")
         return False
 
-def start_auditor_session(page_text, page_image_bytes, chapter_index=None):
+# Texto de la página que se envía como contexto (por turno)
+PAGE_CONTEXT_MAX_CHARS = 4000
+
+# Nota que precede a la imagen de la página en el bloque de contexto. Solo la
+# imagen de la última página enviada queda en el historial: las anteriores se
+# cambian por PAGE_IMAGE_OMITTED (el historial se reenvía en cada turno).
+PAGE_IMAGE_NOTE = "Esta es la IMAGEN de la página actual que estoy viendo. Úsala para el ROL de Auditor."
+PAGE_IMAGE_OMITTED = "(Imagen de esta página omitida del historial: ya no es la página actual.)"
+
+# Tag de navegación que el modelo agrega al final de la respuesta (ROL 1)
+NAVIGATION_TAG = re.compile(r"\[\[IR_A_PAGINA:\s*(\d+)\]\]")
+
+def _book_instruction(chapter_index):
     """
-    Inicia una sesión de chat con contexto HÍBRIDO (Índice Global + Página Local).
+    Instrucción de sistema con el contexto ESTÁTICO del libro (índice global).
+    El contexto de la página actual no va aquí: se agrega como turno al
+    cambiar de página (ver AuditorSession).
     """
-    
-    # Serializar el índice para que la IA lo entienda
+    # Serializar el índice para que la IA lo entienda (compacto: menos tokens)
     index_str = "No disponible"
     if chapter_index:
-        # Convertimos a JSON formateado para claridad
-        index_str = json.dumps(chapter_index, indent=2, ensure_ascii=False)
+        index_str = json.dumps(chapter_index, ensure_ascii=False, separators=(",", ":"))
 
-    system_instruction = f"""
+    return f"""
     Eres "CircuitAI", un Asistente Académico Avanzado con dos roles principales:
 
     ROL 1: NAVEGADOR (Acceso Global)
@@ -43,8 +66,9 @@ def start_auditor_session(page_text, page_image_bytes, chapter_index=None):
 
     ROL 2: AUDITOR (Acceso Local)
     Tienes acceso visual y textual a la PÁGINA ACTUAL que el usuario está viendo.
-    CONTEXTO DE TEXTO DE LA PÁGINA ACTUAL:
-    {page_text[:4000]}... (truncado para eficiencia)
+    Cada vez que el usuario cambia de página, su mensaje empieza con un bloque
+    "CONTEXTO DE LA PÁGINA ACTUAL" (número, texto e imagen de la página).
+    La página actual es siempre la del último bloque recibido.
 
     Si el usuario pide validar un ejercicio o comparar su trabajo:
     1.  **ENFOQUE EN COMPONENTES:** Tu tarea principal es verificar el INVENTARIO DE COMPONENTES.
@@ -56,37 +80,239 @@ def start_auditor_session(page_text, page_image_bytes, chapter_index=None):
     - Si la pregunta es "¿Dónde está X?", usa el ROL 1.
     - Si la pregunta es "¿Está bien este ejercicio?", usa el ROL 2 centrándote en los VALORES de los componentes.
     """
-    
-    model = genai.GenerativeModel(
-        model_name="gemini-flash-latest",
-        system_instruction=system_instruction
-    )
-    
+
+class AuditorSession:
+    """
+    Chat del auditor para un documento, reutilizable entre páginas.
+
+    El índice del libro va una sola vez en la instrucción de sistema. Cambiar
+    de página solo registra el contexto nuevo (set_page, sin red); se envía
+    como prefijo del siguiente mensaje del usuario, y solo si la página
+    cambió desde el último envío. El modelo y el chat se crean en el primer
+    mensaje, no al abrir el documento. Del historial solo se conserva la
+    imagen de la última página enviada; las páginas anteriores quedan como
+    texto.
+    """
+    def __init__(self, chapter_index=None):
+        self.chapter_index = chapter_index
+        self._chat = None
+        self._page = None      # (número, texto, imagen_bytes) de la página visible
+        self._sent_page = None # Número de la última página enviada al modelo
+
+    @property
+    def started(self):
+        """True si el chat ya se creó (hubo al menos un mensaje)."""
+        return self._chat is not None
+
+    def set_page(self, page_number, page_text, page_image_bytes=None):
+        """Registra la página visible (no hace llamadas al modelo)."""
+        self._page = (page_number, page_text or "", page_image_bytes)
+
+    def _ensure_chat(self):
+        if self._chat is None:
+            model = model_client.get_client().model(
+                MODEL_NAME, _book_instruction(self.chapter_index)
+            )
+            self._chat = model.start_chat(history=[])
+        return self._chat
+
+    def _page_context_parts(self):
+        """Bloque de contexto de la página, solo si cambió desde el último envío."""
+        if self._page is None or self._page[0] == self._sent_page:
+            return []
+        page_number, page_text, page_image_bytes = self._page
+        parts = [
+            f"CONTEXTO DE LA PÁGINA ACTUAL (Pág {page_number + 1}):\n"
+            f"{page_text[:PAGE_CONTEXT_MAX_CHARS]}... (truncado para eficiencia)"
+        ]
+        if page_image_bytes:
+            parts.append(PAGE_IMAGE_NOTE)
+            parts.append(Image.open(io.BytesIO(page_image_bytes)))
+        parts.append("--- Fin del contexto de la página ---")
+        return parts
+
+    def send(self, content, stream=False):
+        """
+        Envía un mensaje (lista de partes) con el contexto de página pendiente.
+
+        Args:
+            content (list): Partes del mensaje (texto / imágenes).
+            stream (bool): Respuesta en streaming (iterar los chunks).
+
+        Returns:
+            Respuesta del SDK (GenerateContentResponse). Con stream=True, un
+            iterable de chunks: la página cuenta como enviada recién al
+            terminar de leerlo (si el stream falla se reenvía en el próximo
+            mensaje).
+        """
+        chat = self._ensure_chat()
+        page_parts = self._page_context_parts()
+        if PAGE_IMAGE_NOTE in page_parts:
+            _drop_page_images(chat)
+        response = model_client.get_client().call(
+            chat.send_message, page_parts + list(content), stream=stream
+        )
+        page_number = self._page[0] if self._page is not None else self._sent_page
+        if stream:
+            return self._mark_sent_when_consumed(response, page_number)
+        self._sent_page = page_number
+        return response
+
+    def _mark_sent_when_consumed(self, response, page_number):
+        for chunk in response:
+            yield chunk
+        self._sent_page = page_number
+
+def _part_text(part):
+    """Texto de una parte del mensaje (str o Part del SDK); None si es una imagen."""
+    if isinstance(part, str):
+        return part
+    if isinstance(part, Image.Image):
+        return None
+    return getattr(part, "text", None)
+
+def _without_page_image(parts):
+    """Partes de un turno con la imagen de página cambiada por PAGE_IMAGE_OMITTED."""
+    kept = []
+    drop_next = False
+    for part in parts:
+        if drop_next:
+            drop_next = False
+            continue
+        if _part_text(part) == PAGE_IMAGE_NOTE:
+            kept.append(PAGE_IMAGE_OMITTED if isinstance(part, str) else type(part)(text=PAGE_IMAGE_OMITTED))
+            drop_next = True # La imagen va justo después de la nota
+            continue
+        kept.append(part)
+    return kept
+
+def _drop_page_images(chat):
+    """
+    Quita del historial del chat las imágenes de páginas ya enviadas.
+    El historial es de Content del SDK (role + parts) o, en el backend
+    simulado, de listas de partes.
+    """
     history = []
-    
-    # Inyectar la imagen de la página actual como contexto inicial del ROL 2
-    if page_image_bytes:
-        img = Image.open(io.BytesIO(page_image_bytes))
-        history.append({
-            "role": "user", 
-            "parts": ["Esta es la IMAGEN de la página actual que estoy viendo. Úsala para el ROL de Auditor.", img]
-        })
-        history.append({
-            "role": "model", 
-            "parts": ["Entendido. Tengo el índice global para navegar y la imagen de esta página para auditar. ¿En qué te ayudo?"]
-        })
-    
-    chat = model.start_chat(history=history)
-    return chat
+    for content in chat.history:
+        if isinstance(content, list):
+            history.append(_without_page_image(content))
+        else:
+            history.append(type(content)(role=content.role, parts=_without_page_image(content.parts)))
+    chat.history = history
+
+def start_auditor_session(page_text, page_image_bytes, chapter_index=None, page_number=0):
+    """
+    Inicia una sesión de chat con contexto HÍBRIDO (Índice Global + Página Local).
+    La sesión es perezosa: el chat se crea con el primer send_message.
+    """
+    session = AuditorSession(chapter_index)
+    session.set_page(page_number, page_text, page_image_bytes)
+    return session
+
+def _to_pil_image(image):
+    """
+    Acepta bytes, PIL.Image o un objeto con to_pil() (image_shield.ScanImage).
+    La codificación a bytes la hace el SDK al enviar: esta es la frontera.
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if hasattr(image, "to_pil"):
+        return image.to_pil()
+    return Image.open(io.BytesIO(image))
+
+def _rotation_plan(image, pil_image):
+    """
+    Grupos de rotaciones a probar, en orden. Las de un mismo grupo se envían
+    en paralelo (la orientación local no distingue -90° de +90°).
+    """
+    if hasattr(image, "orientation"):
+        orientation, _ = image.orientation()
+    else:
+        import image_shield # Import diferido (OpenCV)
+        orientation, _ = image_shield.estimate_orientation(np.asarray(pil_image.convert("L")))
+
+    if orientation == "horizontal":
+        return [[0], [-90, 90]]
+    if orientation == "vertical":
+        return [[-90, 90], [0]]
+    return [[0, -90, 90]] # Sin confianza: las tres a la vez
 
-def extract_problem_signature(image_bytes):
+def _first_signature(scan_fn, pil_image, angles):
+    """
+    Ejecuta scan_fn sobre cada rotación concurrentemente y retorna la primera
+    firma no vacía (las llamadas restantes se descartan). Si ninguna da firma
+    y alguna falló, se relanza el error (ModelError) en vez de retornar [].
+    """
+    def rotated(angle):
+        return pil_image if angle == 0 else pil_image.rotate(angle, expand=True)
+
+    if len(angles) == 1:
+        return scan_fn(rotated(angles[0]))
+
+    executor = ThreadPoolExecutor(max_workers=len(angles))
+    try:
+        futures = [executor.submit(scan_fn, rotated(angle)) for angle in angles]
+        error = None
+        for future in as_completed(futures):
+            try:
+                signature = future.result()
+            except model_client.ModelError as e:
+                error = error or e
+                continue
+            if signature:
+                return signature
+        if error is not None:
+            raise error
+        return []
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _image_hashes(image, pil_image):
+    """
+    (hash perceptual, rasgos de contenido) de la imagen, las claves de
+    signature_cache; None si no se pueden calcular.
+    """
+    try:
+        if hasattr(image, "perceptual_hash"):
+            return image.perceptual_hash(), image.content_features()
+        import image_shield # Import diferido (OpenCV)
+        gray = np.asarray(pil_image.convert("L"))
+        return image_shield.perceptual_hash(gray), image_shield.content_features(gray)
+    except Exception as e:
+        print(f"Advertencia: No se pudo calcular el hash de la imagen: {e}")
+        return None
+
+def extract_problem_signature(image, use_cache=True):
     """
     Usa Gemini Vision para extraer una 'Firma Digital' del problema.
-    Implementa 'Smart Scan': Si falla, rota la imagen y reintenta.
+    Implementa 'Smart Scan': la orientación se estima localmente
+    (image_shield.estimate_orientation) antes de la primera llamada; si no
+    hay confianza, las rotaciones posibles se consultan en paralelo y se
+    queda la primera respuesta no vacía.
+
+    Fotos casi idénticas a una ya escaneada reutilizan su firma desde
+    signature_cache (sin llamar al modelo).
+
+    Args:
+        image: Bytes de la imagen, PIL.Image o image_shield.ScanImage
+               (se usa su buffer limpio sin re-codificar).
+        use_cache (bool): Consultar y alimentar la caché de firmas.
+
+    Raises:
+        model_client.ModelError: El servicio no respondió tras los reintentos.
     """
     try:
-        model = genai.GenerativeModel("gemini-flash-latest")
-        original_img = Image.open(io.BytesIO(image_bytes))
+        original_img = _to_pil_image(image)
+
+        image_hashes = _image_hashes(image, original_img) if use_cache else None
+        if image_hashes is not None:
+            cached, distance = signature_cache.SIGNATURE_CACHE.lookup(*image_hashes)
+            if cached:
+                print(f"Info: Firma desde caché (distancia {distance} bits).")
+                return cached
+
+        client = model_client.get_client()
+        model = client.model(MODEL_NAME)
         
         prompt = """
         ACTÚA COMO: Extractor de Datos OCR de Alta Precisión para Ingeniería.
@@ -104,64 +330,97 @@ def extract_problem_signature(image_bytes):
         """
         
         # Función auxiliar para llamar al modelo
+        # Los errores del servicio (429 persistente) se propagan como
+        # ModelError: no deben confundirse con "no se detectaron valores"
         def scan_image(img_obj):
+            response = client.generate(model, [prompt, img_obj], model_name=MODEL_NAME)
             try:
-                response = model.generate_content([prompt, img_obj])
                 text = response.text.strip()
-                # Limpieza básica
-                return [x.strip() for x in text.split(',') if x.strip()]
-            except:
-                return []
+            except ValueError:
+                return [] # Respuesta sin texto (bloqueada o vacía)
+            # Limpieza básica
+            return [x.strip() for x in text.split(',') if x.strip()]
 
-        # INTENTO 1: Orientación Original
-        signature = scan_image(original_img)
-        
-        if signature:
-            return signature
-            
-        # INTENTO 2: Rotación 90° (Sentido Horario - Típico de fotos móviles)
-        # print("⚠️ Firma débil. Activando Smart Scan (Rotación 90°)...")
-        rotated_img = original_img.rotate(-90, expand=True)
-        signature = scan_image(rotated_img)
-        
-        if signature:
-            return signature
-
-        # INTENTO 3: Rotación 90° (Sentido Anti-horario - Por si acaso)
-        rotated_img_2 = original_img.rotate(90, expand=True)
-        return scan_image(rotated_img_2)
+        # Rotación elegida localmente primero; el resto solo si falla
+        for angles in _rotation_plan(image, original_img):
+            signature = _first_signature(scan_image, original_img, angles)
+            if signature:
+                if image_hashes is not None:
+                    signature_cache.SIGNATURE_CACHE.store(*image_hashes, signature)
+                return signature
+        return []
         
+    except model_client.ModelError:
+        raise
     except Exception as e:
         print(f"Error en extracción de firma: {e}")
         return []
 
+def _message_parts(user_text, context_images=None):
+    """Arma las partes del mensaje: texto del usuario + imágenes adjuntas."""
+    content = []
+    if user_text:
+        content.append(user_text)
+        
+    if context_images:
+        # Normalizar a lista si es un solo objeto de bytes
+        if isinstance(context_images, bytes):
+            context_images = [context_images]
+            
+        for i, img_bytes in enumerate(context_images):
+            img = Image.open(io.BytesIO(img_bytes))
+            content.append(img)
+            content.append(f"--- Adjunto {i+1}: Documento/Imagen del usuario ---")
+    return content
+
+def _send(chat_session, content, stream=False):
+    # Duck typing: app.py recarga este módulo y la clase cambia de identidad
+    if hasattr(chat_session, "set_page"):
+        return chat_session.send(content, stream=stream)
+    return chat_session.send_message(content, stream=stream)
+
 def send_message(chat_session, user_text, context_images=None):
     """
     Envía mensaje al auditor.
     Args:
-        chat_session: Sesión de chat activa.
+        chat_session: AuditorSession (o una sesión de chat del SDK).
         user_text: Texto del usuario.
         context_images: Lista de bytes de imágenes (o una sola imagen en bytes) para analizar.
     """
     try:
-        content = []
-        if user_text:
-            content.append(user_text)
-            
-        if context_images:
-            # Normalizar a lista si es un solo objeto de bytes
-            if isinstance(context_images, bytes):
-                context_images = [context_images]
-                
-            for i, img_bytes in enumerate(context_images):
-                img = Image.open(io.BytesIO(img_bytes))
-                content.append(img)
-                content.append(f"--- Adjunto {i+1}: Documento/Imagen del usuario ---")
-            
+        content = _message_parts(user_text, context_images)
         if not content:
             return "Por favor envía texto o adjunta un archivo."
-            
-        response = chat_session.send_message(content)
-        return response.text
+        return _send(chat_session, content).text
     except Exception as e:
         return f"Error de comunicación con la IA: {e}"
+
+def send_message_stream(chat_session, user_text, context_images=None):
+    """
+    Igual que send_message, pero entrega la respuesta por partes a medida que
+    llega (generador de strings, apto para st.write_stream).
+
+    El tag [[IR_A_PAGINA: n]] puede quedar partido entre dos chunks: se debe
+    buscar con find_navigation_page sobre el texto completo, al terminar.
+    """
+    try:
+        content = _message_parts(user_text, context_images)
+        if not content:
+            yield "Por favor envía texto o adjunta un archivo."
+            return
+        for chunk in _send(chat_session, content, stream=True):
+            text = chunk.text
+            if text:
+                yield text
+    except Exception as e:
+        yield f"Error de comunicación con la IA: {e}"
+
+def find_navigation_page(response_text):
+    """
+    Página destino (1-indexed) del tag [[IR_A_PAGINA: n]], o None.
+    Si hay varios tags se usa el último.
+    """
+    if not response_text:
+        return None
+    matches = NAVIGATION_TAG.findall(response_text)
+    return int(matches[-1]) if matches else None
@@ -2,20 +2,33 @@ import streamlit as st
 import backend
 import search_engine
 import ai_chat
-import converter
-import image_shield # Módulo de Robustez
+import page_store
+import prefetch
+import artifact_store
+import signature_cache
+import model_client
+import metrics
+import component_inventory
+import document_pool
+import text_utils
 import os
-import tempfile
-import pandas as pd
-import importlib
-import re
-
-# Forzar recarga de módulos críticos para desarrollo en caliente
-importlib.reload(backend)
-importlib.reload(search_engine)
-importlib.reload(ai_chat)
-importlib.reload(converter)
-importlib.reload(image_shield)
+
+# pandas e image_shield (OpenCV) se importan donde se usan, no al arrancar.
+
+# Modo desarrollo (CIRCUIT_VERIFIER_DEV=1): recargar los módulos en cada
+# ejecución para ver cambios en caliente. En producción (por defecto) se
+# importan una sola vez por proceso.
+DEV_MODE = os.environ.get("CIRCUIT_VERIFIER_DEV") == "1"
+if DEV_MODE:
+    import importlib
+    import converter
+    import image_shield
+    importlib.reload(backend)
+    importlib.reload(search_engine)
+    importlib.reload(ai_chat)
+    importlib.reload(converter)
+    importlib.reload(image_shield)
+    importlib.reload(page_store)
 
 # --- Configuración de la Página ---
 st.set_page_config(
@@ -28,29 +41,43 @@ st.set_page_config(
 # --- FASE 1: Gestión de Estado (Reset) ---
 def reset_state():
     """Limpia el estado de la sesión al cambiar de archivo."""
+    if 'prefetcher' in st.session_state:
+        st.session_state.prefetcher.cancel()
+    # Cerrar explícitamente: suelta la referencia de esta sesión en el pool
+    # (los handles se cierran cuando ninguna sesión usa el archivo)
+    doc = st.session_state.get('doc')
+    if doc is not None:
+        doc.close()
     keys_to_reset = ['doc', 'chapter_index', 'search_results', 'current_page', 'chat_session', 'messages']
     for key in keys_to_reset:
         if key in st.session_state:
             del st.session_state[key]
 
 # --- FASE 2: Capa de Caché (Optimización) ---
-@st.cache_resource
-def load_cached_pdf(file_path):
-    """Carga el PDF y lo mantiene en memoria caché (RAM)."""
-    return backend.load_pdf(file_path)
+def load_session_pdf(file_path):
+    """
+    Documento de esta sesión. No se comparte entre sesiones (fitz.Document
+    no es thread-safe): los handles reales salen de document_pool, acotados
+    y reutilizados entre sesiones del mismo archivo.
+    """
+    return backend.load_pdf(file_path, pooled=True)
 
 @st.cache_data
-def get_cached_chapter_index(_doc, doc_name):
-    """Genera el índice de capítulos y lo guarda en caché."""
+def get_cached_chapter_index(_doc, doc_hash):
+    """Genera el índice de capítulos y lo guarda en caché (por contenido, no por nombre)."""
     return backend.generate_chapter_index(_doc)
 
-@st.cache_data
-def convert_file_cached(file_path, suffix):
-    """Cachea la conversión de archivos pesados."""
-    return converter.convert_to_pdf(file_path, suffix)
+def load_session_document(file_path, suffix):
+    """Indexa Word/Excel/imagen sin convertir (el PDF se genera al visualizar)."""
+    return backend.load_document(file_path, suffix, pooled=True)
 
-# --- Inicializar IA ---
-ai_ready = ai_chat.initialize_ai()
+# --- Inicializar IA (una vez por proceso, no en cada rerun) ---
+@st.cache_resource
+def initialize_ai_once():
+    """Lee secrets.toml y registra la API key una sola vez."""
+    return ai_chat.initialize_ai()
+
+ai_ready = initialize_ai_once()
 
 # --- Estilos CSS Personalizados (Vivid Light Theme - FAB Fix) ---
 st.markdown("""
@@ -213,6 +240,8 @@ if 'current_page' not in st.session_state:
     st.session_state.current_page = 0
 if 'search_results' not in st.session_state:
     st.session_state.search_results = []
+if 'prefetcher' not in st.session_state:
+    st.session_state.prefetcher = prefetch.PrefetchScheduler()
 
 # --- Lógica de Rangos de Capítulos ---
 def get_chapter_range(chapter_name, index, total_pages):
@@ -246,26 +275,25 @@ with st.sidebar:
         if st.session_state.doc is None or uploaded_file.name != st.session_state.filename:
             with st.spinner("Procesando archivo..."):
                 suffix = "." + uploaded_file.name.split('.')[-1]
-                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    tmp_path = tmp_file.name
+                # Guardado por hash de contenido: re-subir el mismo libro reutiliza
+                # el archivo, la conversión, el PDF cargado y los índices.
+                _, stored_path = artifact_store.store_upload(uploaded_file.getvalue(), suffix)
                 
-                final_pdf_path = tmp_path
-                if suffix.lower() not in ['.pdf']:
-                    with st.spinner(f"Convirtiendo {suffix}..."):
-                        final_pdf_path = convert_file_cached(tmp_path, suffix)
+                if suffix.lower() in ['.pdf']:
+                    doc = load_session_pdf(stored_path)
+                else:
+                    # Word/Excel/imagen: se indexa el texto directamente; el PDF
+                    # solo se genera si se visualiza una página.
+                    with st.spinner(f"Indexando {suffix}..."):
+                        doc = load_session_document(stored_path, suffix)
                 
-                if final_pdf_path:
-                    doc = load_cached_pdf(final_pdf_path)
-                    if doc:
-                        st.session_state.doc = doc
-                        st.session_state.filename = uploaded_file.name
-                        st.session_state.chapter_index = get_cached_chapter_index(doc, uploaded_file.name)
-                        st.success(f"✅ Libro Cargado ({doc.page_count} págs)")
-                    else:
-                        st.error("Error al leer documento.")
+                if doc:
+                    st.session_state.doc = doc
+                    st.session_state.filename = uploaded_file.name
+                    st.session_state.chapter_index = get_cached_chapter_index(doc, page_store.document_hash(doc))
+                    st.success(f"✅ Libro Cargado ({doc.page_count} págs)")
                 else:
-                    st.error("Formato no soportado.")
+                    st.error("Error al leer documento.")
 
     # Filtro de Capítulos (En Sidebar para no estorbar)
     selected_range = None
@@ -298,7 +326,7 @@ else:
         with st.form("search_form_main"):
             col_in, col_btn = st.columns([3, 1])
             with col_in:
-                query = st.text_input("Valores Clave", placeholder="Ej: 10k, 12V", label_visibility="collapsed")
+                query = st.text_input("Valores Clave", placeholder="Ej: 10k, 12V, 4.5k-5k, 100nF±10%", label_visibility="collapsed")
             with col_btn:
                 search_submitted = st.form_submit_button("Buscar", use_container_width=True)
                 
@@ -319,19 +347,26 @@ else:
         search_img = st.file_uploader("Subir Foto Ejercicio", type=["png", "jpg", "jpeg"], key="main_img_search")
         if search_img:
             # Blur Check
-            img_bytes = search_img.getvalue()
-            is_blurry, blur_score = image_shield.detect_blur(img_bytes)
+            import image_shield # Import diferido (OpenCV)
+            # Se decodifica una sola vez: blur, limpieza y firma comparten el buffer
+            scan = image_shield.ScanImage(search_img.getvalue())
+            is_blurry, blur_score = scan.blur()
             
             if is_blurry:
                 st.warning(f"⚠️ Imagen borrosa (Score: {int(blur_score)}).")
             
             if st.button("🔍 Escanear Foto", use_container_width=True):
+                service_error = None
                 with st.spinner("Procesando visión..."):
-                    clean_bytes = image_shield.clean_image(img_bytes)
-                    raw_sig = ai_chat.extract_problem_signature(clean_bytes)
+                    try:
+                        raw_sig = ai_chat.extract_problem_signature(scan)
+                    except model_client.ModelError as e:
+                        service_error, raw_sig = e, []
                     signature = image_shield.sanitize_ocr(raw_sig)
                 
-                if signature:
+                if service_error:
+                    st.error(f"El servicio de IA está saturado, intenta de nuevo en unos segundos. ({service_error})")
+                elif signature:
                     st.success(f"Detectado: {signature}")
                     results = search_engine.search_by_unique_values(st.session_state.doc, signature)
                     st.session_state.search_results = results
@@ -343,6 +378,10 @@ else:
                 else:
                     st.error("No se detectaron valores.")
 
+                sig_stats = signature_cache.SIGNATURE_CACHE.stats()
+                st.caption(f"Caché de firmas: {sig_stats['hits']} aciertos, "
+                           f"{sig_stats['misses']} fallos ({sig_stats['hit_rate']:.0%})")
+
     # --- ZONA DE RESULTADOS ---
     if st.session_state.search_results:
         st.markdown(f"### 🎯 Resultados ({len(st.session_state.search_results)})")
@@ -376,20 +415,57 @@ else:
                     st.rerun()
 
     # Renderizado
-    txt, img_bytes = backend.extract_page_data(st.session_state.doc, st.session_state.current_page)
+    # Word/Excel indexados sin conversión: el PDF para renderizar solo se
+    # genera si el usuario pide ver la página; mientras tanto, su texto.
+    doc = st.session_state.doc
+    text_only = getattr(doc, "is_materialized", True) is False
+    if text_only:
+        txt = page_store.get_page_text(doc, st.session_state.current_page)
+        img_bytes = None
+        if doc.file_extension in ("png", "jpg", "jpeg"):
+            with open(doc.name, "rb") as f:
+                img_bytes = f.read() # La imagen subida ya es la página
+    else:
+        txt, img_bytes = backend.extract_page_data(doc, st.session_state.current_page)
+
+        # Precarga en segundo plano: vecinas (⬅️/➡️) y mejores resultados
+        st.session_state.prefetcher.schedule(
+            doc,
+            prefetch.prefetch_targets(
+                st.session_state.current_page,
+                doc.page_count,
+                st.session_state.search_results
+            )
+        )
     
     # Expander para la imagen (Ahorra espacio en móvil)
     with st.expander("📸 Ver Página Original", expanded=True):
         if img_bytes:
             st.image(img_bytes, use_column_width=True)
+        elif text_only:
+            st.text(txt or "(Página sin texto)")
+            if st.button("🖼️ Ver página renderizada", use_container_width=True):
+                with st.spinner("Generando PDF del documento..."):
+                    backend.get_rendered_page(doc, st.session_state.current_page)
+                st.rerun()
         else:
             st.error("Error visual.")
 
     # Verificación de Componentes
-    detected_components = search_engine.extract_circuit_components(txt)
+    # Desde el inventario precalculado del libro si su texto ya está en caché;
+    # si no, solo de esta página (verla no extrae el libro completo)
+    inventory = component_inventory.get_cached_inventory(st.session_state.doc)
+    if inventory is not None:
+        detected_components = inventory.page_components(st.session_state.current_page)
+    else:
+        detected_components = component_inventory.text_components(text_utils.normalize_text(txt))
     if detected_components:
         with st.expander("📋 Componentes Detectados", expanded=False):
-            df_comps = pd.DataFrame(detected_components, columns=["Valor"])
+            import pandas as pd
+            df_comps = pd.DataFrame(
+                [(c["text"], c["count"]) for c in detected_components],
+                columns=["Valor", "Apariciones"]
+            )
             st.dataframe(df_comps, use_container_width=True, hide_index=True)
             
     st.markdown('</div>', unsafe_allow_html=True)
@@ -398,21 +474,20 @@ else:
     if ai_ready:
         st.markdown("---")
         with st.expander("💬 Chat Auditoría (Gemini)", expanded=True):
-            # Inicializar chat
-            if "chat_session" not in st.session_state or st.session_state.get("last_page_context") != st.session_state.current_page:
-                st.session_state.chat_session = ai_chat.start_auditor_session(
-                    txt, img_bytes, st.session_state.chapter_index
-                )
-                st.session_state.last_page_context = st.session_state.current_page
+            # Una sesión por documento (se crea al cargarlo y se descarta en reset_state).
+            # Cambiar de página solo actualiza el contexto; nada se envía hasta
+            # que el usuario escribe.
+            if "chat_session" not in st.session_state:
+                st.session_state.chat_session = ai_chat.AuditorSession(st.session_state.chapter_index)
                 st.session_state.messages = []
+            st.session_state.chat_session.set_page(st.session_state.current_page, txt, img_bytes)
 
             # Historial
             for i, msg in enumerate(st.session_state.messages):
                 st.chat_message(msg["role"]).write(msg["content"])
                 if msg["role"] == "assistant":
-                    match = re.search(r"\[\[IR_A_PAGINA:\s*(\d+)\]\]", msg["content"])
-                    if match:
-                        target_page = int(match.group(1))
+                    target_page = ai_chat.find_navigation_page(msg["content"])
+                    if target_page is not None:
                         if st.button(f"🚀 Ir a Pág {target_page}", key=f"nav_{i}", use_container_width=True):
                             st.session_state.current_page = target_page - 1
                             st.rerun()
@@ -424,7 +499,32 @@ else:
                 with st.chat_message("user"):
                     st.write(user_input)
                 
-                with st.spinner("Pensando..."):
-                    response = ai_chat.send_message(st.session_state.chat_session, user_input)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                    st.rerun()
+                # La respuesta se muestra a medida que llega; el tag de
+                # navegación se detecta sobre el texto completo (tras el rerun)
+                with st.chat_message("assistant"):
+                    response = st.write_stream(
+                        ai_chat.send_message_stream(st.session_state.chat_session, user_input)
+                    )
+                st.session_state.messages.append({"role": "assistant", "content": response})
+                st.rerun()
+
+# --- SIDEBAR: Panel de métricas (al final, para incluir lo medido en esta ejecución) ---
+with st.sidebar:
+    if st.checkbox("🛠️ Métricas (debug)", value=False):
+        import pandas as pd
+        summary = metrics.METRICS.summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Sin eventos todavía.")
+
+        render_stats = backend.get_render_cache_stats()
+        st.caption(f"Caché de renders: {render_stats['entries']} págs, "
+                   f"{render_stats['bytes'] / 1e6:.1f} MB, aciertos {render_stats['hit_rate']:.0%}")
+        st.caption(f"Modelo: {model_client.get_client().stats()}")
+        st.caption(f"Pool de documentos: {document_pool.POOL.stats()}")
+
+        with st.expander("Eventos recientes"):
+            st.dataframe(pd.DataFrame(metrics.METRICS.recent(30)), use_container_width=True, hide_index=True)
+        if metrics.METRICS.path:
+            st.caption(f"Exportado a: {metrics.METRICS.path}")
@@ -0,0 +1,129 @@
+import os
+import re
+import hashlib
+import tempfile
+
+import page_store
+
+# Archivos subidos y convertidos, nombrados por hash de contenido
+ARTIFACT_DIR = os.path.join(page_store.CACHE_DIR, "artifacts")
+
+# Tope de espacio en disco (MB). Al superarlo se borran los menos usados.
+ARTIFACT_MAX_MB = int(os.environ.get("CIRCUIT_VERIFIER_ARTIFACT_MAX_MB", 2048))
+
+_HASH_NAME = re.compile(r"^([0-9a-f]{64})(\..+)?$")
+
+def content_hash(data):
+    """SHA-256 (hex) de los bytes de un archivo."""
+    return hashlib.sha256(data).hexdigest()
+
+def store_upload(data, suffix):
+    """
+    Guarda un archivo subido en el directorio de artefactos, nombrado por su hash.
+    Si ya existe (misma subida anterior) no se reescribe.
+
+    Args:
+        data (bytes): Contenido del archivo.
+        suffix (str): Extensión con punto (ej: ".pdf").
+
+    Returns:
+        tuple: (content_hash, ruta_absoluta)
+    """
+    digest = content_hash(data)
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = os.path.join(ARTIFACT_DIR, f"{digest}{suffix.lower()}")
+
+    if not os.path.exists(path):
+        # Temporal propio: dos sesiones que suben lo mismo no comparten archivo
+        fd, tmp_path = tempfile.mkstemp(dir=ARTIFACT_DIR, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path) # Escritura atómica
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    touch(path)
+
+    enforce_size_cap(keep=[path])
+    return digest, path
+
+def touch(path):
+    """Marca un artefacto como usado recientemente (LRU por mtime)."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def artifact_id(path):
+    """
+    Identificador por contenido de un artefacto, derivado de su nombre
+    (ej: '<hash>.docx.converted-v3.pdf' -> '<hash>.docx.converted-v3').
+    Retorna None si la ruta no es un artefacto de este directorio.
+    """
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    if os.path.dirname(path) != os.path.abspath(ARTIFACT_DIR):
+        return None
+    name = os.path.basename(path)
+    if not _HASH_NAME.match(name):
+        return None
+    # La extensión final (.pdf) no forma parte de la identidad; el resto sí,
+    # para distinguir el original de sus conversiones.
+    if name.endswith(".pdf"):
+        name = name[:-len(".pdf")]
+    return name
+
+def enforce_size_cap(max_bytes=None, keep=()):
+    """
+    Borra los artefactos menos usados hasta quedar bajo el tope de espacio.
+    Nunca borra archivos retenidos en document_pool.POOL (libros y PDFs
+    convertidos que alguna sesión tiene abiertos): el pool reabre handles
+    bajo demanda y necesita el archivo en disco.
+
+    Args:
+        max_bytes (int, optional): Tope en bytes. Por defecto ARTIFACT_MAX_MB.
+        keep (iterable): Rutas que tampoco se deben borrar (ej: la subida en curso).
+
+    Returns:
+        int: Cantidad de archivos borrados.
+    """
+    if max_bytes is None:
+        max_bytes = ARTIFACT_MAX_MB * 1024 * 1024
+    if not os.path.isdir(ARTIFACT_DIR):
+        return 0
+
+    keep = {os.path.abspath(p) for p in keep}
+    entries = []
+    total = 0
+    for name in os.listdir(ARTIFACT_DIR):
+        path = os.path.join(ARTIFACT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        total += stat.st_size
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep or _in_use(path):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError as e:
+            print(f"Advertencia: No se pudo borrar el artefacto {path}: {e}")
+    if removed:
+        print(f"Info: Limpieza de artefactos: {removed} archivos borrados.")
+    return removed
+
+def _in_use(path):
+    """Indica si alguna sesión tiene abierto el archivo (document_pool)."""
+    import document_pool # Import diferido: document_pool depende de page_store y fitz
+
+    return document_pool.POOL.is_retained(path)
@@ -1,18 +1,45 @@
 import fitz  # PyMuPDF
 import re
+import threading
 import io
 import os
+import json
+import tempfile
+import weakref
 from PIL import Image
+import page_store
+import artifact_store
+import converter
+import parallel_scan
+import render_cache
+import metrics
+import document_pool
 
-def load_pdf(filepath):
+# Presupuesto de la caché de páginas renderizadas (MB, configurable)
+RENDER_CACHE_MAX_MB = int(os.environ.get("CIRCUIT_VERIFIER_RENDER_CACHE_MB", 256))
+
+# Índices de capítulos persistidos por hash de contenido
+CHAPTER_CACHE_DIR = os.path.join(page_store.CACHE_DIR, "chapters")
+CHAPTER_CACHE_VERSION = 2 # Sigue a page_store.STORE_VERSION
+
+# Fracción superior de la página donde se buscan títulos de capítulo (modo rápido)
+HEADER_REGION_FRACTION = 0.25
+
+# Se preserva entre reruns de Streamlit (importlib.reload conserva el __dict__)
+if "RENDER_CACHE" not in globals():
+    RENDER_CACHE = render_cache.RenderCache(RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+def load_pdf(filepath, pooled=False):
     """
     Carga un documento PDF en memoria de manera segura.
     
     Args:
         filepath (str): Ruta absoluta al archivo PDF.
+        pooled (bool): Si es True retorna un document_pool.PooledDocument
+                       (handles por hilo, para sesiones concurrentes).
         
     Returns:
-        fitz.Document: Objeto del documento si la carga es exitosa.
+        fitz.Document | PooledDocument: Objeto del documento si la carga es exitosa.
         None: Si ocurre un error.
     """
     if not os.path.exists(filepath):
@@ -20,25 +47,133 @@ def load_pdf(filepath):
         return None
 
     try:
-        doc = fitz.open(filepath)
+        with metrics.timed("document_load", format="pdf") as event:
+            doc = document_pool.open_document(filepath) if pooled else fitz.open(filepath)
+            event["pages"] = doc.page_count
         print(f"Éxito: Documento cargado. Total páginas: {doc.page_count}")
         return doc
     except Exception as e:
         print(f"Error crítico al cargar el PDF: {e}")
         return None
 
-def extract_page_data(doc, page_number):
+class LazyDocument:
+    """
+    Documento Word/Excel/imagen indexado directamente desde su texto.
+
+    Expone la parte de la interfaz de fitz.Document que usa la app
+    (page_count, name, get_toc) y lease() como PooledDocument. El PDF solo
+    se genera la primera vez que se necesita una página renderizada, y sus
+    handles salen de document_pool.POOL.
+    """
+    def __init__(self, source_path, file_extension, page_count=0):
+        self.name = source_path
+        self.file_extension = file_extension
+        self.page_count = page_count
+        self._pdf_path = None
+        self._lock = threading.Lock()
+        # Archivos retenidos en el pool (original y, si se genera, su PDF):
+        # enforce_size_cap no los borra mientras el documento esté abierto
+        self._retained = [source_path]
+        document_pool.POOL.retain(source_path)
+        self._finalizer = weakref.finalize(self, _release_files, self._retained)
+
+    def __len__(self):
+        return self.page_count
+
+    @property
+    def is_closed(self):
+        return not self._finalizer.alive
+
+    @property
+    def is_materialized(self):
+        return self._pdf_path is not None
+
+    def _materialize(self):
+        """Convierte a PDF (una sola vez) y registra la sesión en el pool."""
+        with self._lock:
+            if self.is_closed:
+                raise ValueError(f"Documento cerrado: {self.name}")
+            if self._pdf_path is None:
+                print(f"Info: Generando PDF para visualizar {os.path.basename(self.name)}...")
+                pdf_path = converter.convert_to_pdf(self.name, self.file_extension)
+                if not pdf_path:
+                    raise RuntimeError(f"No se pudo convertir {self.name} a PDF")
+                artifact_store.touch(pdf_path)
+                document_pool.POOL.retain(pdf_path)
+                self._retained.append(pdf_path)
+                self._pdf_path = pdf_path
+            return self._pdf_path
+
+    def lease(self):
+        """fitz.Document del PDF generado, exclusivo durante el bloque."""
+        return document_pool.POOL.lease(self._materialize())
+
+    def get_toc(self):
+        return [] # Sin marcadores: el índice sale del escaneo de texto
+
+    def close(self):
+        with self._lock:
+            self._finalizer() # Idempotente
+
+def _release_files(paths):
+    """Suelta las referencias de un LazyDocument en el pool."""
+    for path in paths:
+        document_pool.POOL.release_file(path)
+
+def load_document(filepath, file_extension, pooled=False):
+    """
+    Carga cualquier formato soportado.
+
+    PDF se abre con PyMuPDF (a través de document_pool si pooled=True).
+    Word, Excel e imágenes se indexan directamente desde su texto (sin pasar
+    por un PDF intermedio) y se devuelven como LazyDocument, que genera el
+    PDF solo si se visualiza una página.
+
+    Returns:
+        fitz.Document | LazyDocument: Documento cargado. None si hay error.
+    """
+    extension = file_extension.lower().replace('.', '')
+    if extension == 'pdf':
+        return load_pdf(filepath, pooled)
+
+    if not os.path.exists(filepath):
+        print(f"Error: El archivo no existe en la ruta: {filepath}")
+        return None
+
+    try:
+        with metrics.timed("document_load", format=extension) as event:
+            doc = LazyDocument(filepath, extension)
+            store = page_store.get_cached_page_store(doc)
+            event["cached"] = store is not None
+            if store is None:
+                pages = converter.extract_text_pages(filepath, extension)
+                if pages is None:
+                    print(f"Error: Formato no soportado: {extension}")
+                    return None
+                store = page_store.save_page_texts(doc, pages)
+            doc.page_count = store.page_count
+            event["pages"] = doc.page_count
+        print(f"Éxito: Documento indexado sin conversión. Total páginas: {doc.page_count}")
+        return doc
+    except Exception as e:
+        print(f"Error crítico al indexar el documento: {e}")
+        return None
+
+def extract_page_data(doc, page_number, zoom=2.0, image_format="png"):
     """
     Extrae texto e imagen de una página específica.
+    La imagen se sirve desde RENDER_CACHE si ya fue renderizada.
     
     Args:
         doc (fitz.Document): Objeto del documento cargado.
         page_number (int): Número de página (0-indexed).
+        zoom (float): Factor de escala del render (2.0 = alta resolución).
+        image_format (str): Formato de salida de PyMuPDF ("png", "jpg"...).
         
     Returns:
         tuple: (text, image_bytes)
             - text (str): Texto crudo de la página.
-            - image_bytes (bytes): Imagen renderizada en formato PNG.
+            - image_bytes (bytes): Imagen renderizada en el formato pedido.
             Retorna (None, None) si hay error.
     """
     try:
@@ -47,18 +182,11 @@ def extract_page_data(doc, page_number):
             print(f"Error: Página {page_number} fuera de rango.")
             return None, None
 
-        page = doc.load_page(page_number)
-        
-        # 1. Extraer texto
-        text = page.get_text("text")
-        
-        # 2. Renderizar imagen (Zoom 2.0 para alta resolución)
-        zoom = 2.0
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
+        # 1. Texto (desde la caché por documento)
+        text = page_store.get_page_text(doc, page_number)
         
-        # Convertir a bytes (PNG) para uso en UI
-        image_bytes = pix.tobytes("png")
+        # 2. Imagen: reutilizar el render si ya está en caché
+        image_bytes = get_rendered_page(doc, page_number, zoom, image_format)
         
         return text, image_bytes
 
@@ -66,9 +194,64 @@ def extract_page_data(doc, page_number):
         print(f"Error al extraer datos de la página {page_number}: {e}")
         return None, None
 
-def generate_chapter_index(doc):
+def render_page(doc, page_number, zoom=2.0, image_format="png"):
+    """
+    Renderiza una página a bytes de imagen (sin caché).
+    """
+    with metrics.timed("render", page=page_number, zoom=zoom):
+        with document_pool.lease(doc) as handle:
+            page = handle.load_page(page_number)
+            mat = fitz.Matrix(zoom, zoom)
+            pix = page.get_pixmap(matrix=mat)
+    with metrics.timed("image_encode", format=image_format) as event:
+        image_bytes = pix.tobytes(image_format)
+        event["bytes"] = len(image_bytes)
+    return image_bytes
+
+def get_rendered_page(doc, page_number, zoom=2.0, image_format="png"):
+    """
+    Imagen de una página desde RENDER_CACHE, renderizándola si falta.
+    Seguro de llamar desde hilos en segundo plano (prefetch).
+    """
+    cache_key = (page_store.document_hash(doc), page_number, zoom, image_format)
+    image_bytes = RENDER_CACHE.get(cache_key)
+    if image_bytes is not None:
+        metrics.incr("render_cache.hit")
+        return image_bytes
+    metrics.incr("render_cache.miss")
+
+    # Sin lock por documento: el render toma un handle del pool y no espera
+    # a que otra sesión suelte el suyo (PyMuPDF retiene el GIL: se intercalan,
+    # no corren en paralelo)
+    image_bytes = render_page(doc, page_number, zoom, image_format)
+    RENDER_CACHE.put(cache_key, image_bytes)
+    return image_bytes
+
+def is_page_rendered(doc, page_number, zoom=2.0, image_format="png"):
+    """Indica si la página ya está en RENDER_CACHE (sin contar hit/miss)."""
+    return (page_store.document_hash(doc), page_number, zoom, image_format) in RENDER_CACHE
+
+def get_render_cache_stats():
+    """Contadores de la caché de renders (hits, misses, bytes...)."""
+    return RENDER_CACHE.stats()
+
+def extract_header_text(page):
+    """
+    Texto de la franja superior de la página (donde van los títulos).
+    Mucho más barato que extraer la página completa.
+    """
+    rect = page.rect
+    header = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * HEADER_REGION_FRACTION)
+    return page.get_text("text", clip=header)
+
+def _chapter_cache_path(doc_hash, fast):
+    mode = "fast" if fast else "full"
+    return os.path.join(CHAPTER_CACHE_DIR, f"{doc_hash}-{mode}.json")
+
+def generate_chapter_index(doc, workers=None, fast=True):
     """
     Genera un índice de navegación (Capítulo -> Página).
+    El resultado se persiste en disco por hash de contenido del documento.
     
     Estrategias:
     1. Metadatos internos (TOC).
@@ -77,15 +260,54 @@ def generate_chapter_index(doc):
     
     Args:
         doc (fitz.Document): Documento cargado.
+        workers (int, optional): Procesos para el escaneo Regex (ver parallel_scan).
+        fast (bool): Si el texto del documento aún no está en caché, escanear
+                     solo la franja superior de cada página en vez del texto completo.
         
     Returns:
         dict: { "Título Capítulo": int_pagina_inicio (0-indexed) }
     """
+    cache_path = _chapter_cache_path(page_store.document_hash(doc), fast)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") == CHAPTER_CACHE_VERSION:
+                print("Info: Índice de capítulos cargado desde caché.")
+                return payload["chapters"]
+        except Exception as e:
+            print(f"Advertencia: Caché de capítulos corrupta ({cache_path}): {e}")
+
+    chapter_map = _build_chapter_index(doc, workers, fast)
+
+    try:
+        os.makedirs(CHAPTER_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CHAPTER_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": CHAPTER_CACHE_VERSION, "chapters": chapter_map}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except Exception as e:
+        print(f"Advertencia: No se pudo persistir el índice de capítulos: {e}")
+
+    return chapter_map
+
+def _build_chapter_index(doc, workers, fast):
+    """Aplica las estrategias de generate_chapter_index (sin caché)."""
     chapter_map = {}
     
     # --- Estrategia 1: TOC Interno ---
     try:
-        toc = doc.get_toc()
+        if hasattr(doc, "lease"):
+            # PooledDocument lee el TOC con su propio handle; LazyDocument no
+            # tiene TOC y no debe generar el PDF solo por esto
+            toc = doc.get_toc()
+        else:
+            with page_store.document_lock(doc):
+                toc = doc.get_toc()
         if toc:
             print(f"Info: TOC interno detectado con {len(toc)} entradas.")
             for entry in toc:
@@ -105,10 +327,20 @@ def generate_chapter_index(doc):
     compiled_patterns = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in patterns]
     
     try:
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text = page.get_text("text", clip=None, flags=0)[:1000]
-            
+        store = page_store.get_cached_page_store(doc)
+        if store is None and not fast:
+            store = page_store.get_page_store(doc, workers)
+
+        if store is not None:
+            # Texto completo ya disponible: mismo recorte de siempre
+            headers = [store.raw[page_num][:1000] for page_num in range(store.page_count)]
+        else:
+            # Modo rápido: solo la franja superior de cada página
+            with document_pool.lease(doc) as handle:
+                scanned = parallel_scan.scan_pages(handle, extract_header_text, workers=workers)
+            headers = [text or "" for _, text in scanned]
+
+        for page_num, text in enumerate(headers):
             for pattern in compiled_patterns:
                 match = pattern.search(text)
                 if match:
@@ -0,0 +1,188 @@
+"""
+Verificación por lotes (sin interfaz): un libro + una carpeta de fotos de
+ejercicios -> un archivo JSONL con la página encontrada para cada foto.
+
+Uso:
+    python batch_verify.py libro.pdf fotos/ -o resultados.jsonl
+
+Es el mismo flujo que la pestaña "Búsqueda Imagen" de app.py (blur ->
+limpieza -> firma -> búsqueda), en un pipeline concurrente:
+    1. Preparación (CPU, hilos): decodificar, blur, limpieza, hash/orientación.
+    2. Firma (red, hilos): ai_chat.extract_problem_signature.
+    3. Búsqueda (CPU, hilo principal): search_engine.search_by_unique_values.
+Mientras unas fotos esperan al modelo, otras se preparan y se buscan.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import backend
+import search_engine
+import value_index
+import ai_chat
+import image_shield
+import model_client
+import signature_cache
+
+PHOTO_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+def list_photos(directory):
+    """Fotos de la carpeta (no recursivo), en orden alfabético."""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(PHOTO_EXTENSIONS)
+    )
+
+def prepare_photo(path, blur_threshold):
+    """Etapa CPU: decodifica y deja listos blur, limpieza, orientación y hash."""
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        scan = image_shield.ScanImage(f.read())
+    if not scan.ok:
+        raise ValueError("No se pudo decodificar la imagen")
+    is_blurry, blur_score = scan.blur(blur_threshold)
+    scan.cleaned()
+    scan.orientation()
+    scan.perceptual_hash()
+    scan.content_features()
+    return scan, {"blurry": bool(is_blurry), "blur_score": round(float(blur_score), 1)}, time.perf_counter() - start
+
+def read_signature(scan):
+    """Etapa de red: firma del ejercicio (la caché de firmas evita repetir llamadas)."""
+    start = time.perf_counter()
+    signature = image_shield.sanitize_ocr(ai_chat.extract_problem_signature(scan))
+    return signature, time.perf_counter() - start
+
+def run_batch(doc, photos, output_path, cpu_workers=2, net_workers=4, top_k=5,
+              blur_threshold=100.0, max_in_flight=None):
+    """
+    Procesa las fotos con el pipeline de 3 etapas y escribe una línea JSON por foto
+    (en orden de finalización).
+
+    Args:
+        doc: Documento del libro (backend.load_document).
+        photos (list): Rutas de las fotos.
+        output_path (str): Archivo JSONL de salida.
+        cpu_workers (int): Hilos de preparación de imágenes.
+        net_workers (int): Llamadas al modelo en paralelo (además del límite
+                           global de model_client).
+        top_k (int): Resultados de búsqueda a guardar por foto.
+        max_in_flight (int, optional): Fotos decodificadas en memoria a la vez.
+
+    Returns:
+        dict: Resumen (fotos, segundos, fotos/s, tiempos por etapa, errores).
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * (cpu_workers + net_workers)
+
+    totals = {"prepare": 0.0, "signature": 0.0, "search": 0.0}
+    counts = {"photos": 0, "found": 0, "no_signature": 0, "errors": 0}
+    start = time.perf_counter()
+    pending_photos = list(reversed(photos))
+    pending = {} # future -> (etapa, ruta, registro)
+
+    def write(out, record):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush() # Un corte a mitad de la noche no pierde lo ya procesado
+        counts["photos"] += 1
+        if record.get("error"):
+            counts["errors"] += 1
+        elif record.get("best_page") is not None:
+            counts["found"] += 1
+        elif not record.get("signature"):
+            counts["no_signature"] += 1
+
+    with ThreadPoolExecutor(cpu_workers, thread_name_prefix="batch-cpu") as cpu_pool, \
+         ThreadPoolExecutor(net_workers, thread_name_prefix="batch-net") as net_pool, \
+         open(output_path, "w", encoding="utf-8") as out:
+
+        def refill():
+            while pending_photos and len(pending) < max_in_flight:
+                path = pending_photos.pop()
+                future = cpu_pool.submit(prepare_photo, path, blur_threshold)
+                pending[future] = ("prepare", path, {"photo": os.path.basename(path)})
+
+        refill()
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, path, record = pending.pop(future)
+                try:
+                    if stage == "prepare":
+                        scan, blur_info, elapsed = future.result()
+                        record.update(blur_info)
+                        record["timings"] = {"prepare": round(elapsed, 4)}
+                        totals["prepare"] += elapsed
+                        pending[net_pool.submit(read_signature, scan)] = ("signature", path, record)
+                        continue
+
+                    signature, elapsed = future.result()
+                    record["signature"] = signature
+                    record["timings"]["signature"] = round(elapsed, 4)
+                    totals["signature"] += elapsed
+
+                    search_start = time.perf_counter()
+                    results = search_engine.search_by_unique_values(doc, signature) if signature else []
+                    elapsed = time.perf_counter() - search_start
+                    record["timings"]["search"] = round(elapsed, 4)
+                    totals["search"] += elapsed
+
+                    record["results"] = [{"page": p + 1, "score": round(s, 1)} for p, s in results[:top_k]]
+                    record["best_page"] = results[0][0] + 1 if results else None
+                    record["error"] = None
+                except Exception as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+                write(out, record)
+            refill()
+
+    elapsed = time.perf_counter() - start
+    n = max(counts["photos"], 1)
+    return {
+        **counts,
+        "seconds": round(elapsed, 3),
+        "photos_per_second": round(counts["photos"] / elapsed, 3) if elapsed else 0.0,
+        "mean_stage_seconds": {k: round(v / n, 4) for k, v in totals.items()},
+        "model_client": model_client.get_client().stats(),
+        "signature_cache": signature_cache.SIGNATURE_CACHE.stats(),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica una carpeta de fotos de ejercicios contra un libro.")
+    parser.add_argument("book", help="Libro (pdf, docx, xlsx...)")
+    parser.add_argument("photos", help="Carpeta con fotos (png/jpg)")
+    parser.add_argument("-o", "--output", default="resultados.jsonl", help="Archivo JSONL de salida")
+    parser.add_argument("--cpu-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--net-workers", type=int, default=model_client.MODEL_MAX_CONCURRENCY)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--blur-threshold", type=float, default=100.0)
+    args = parser.parse_args(argv)
+
+    if not ai_chat.initialize_ai():
+        print("Error: No se pudo inicializar la IA (revisa .streamlit/secrets.toml).")
+        return 1
+
+    doc = backend.load_document(args.book, os.path.splitext(args.book)[1])
+    if doc is None:
+        print(f"Error: No se pudo cargar el libro {args.book}")
+        return 1
+    photos = list_photos(args.photos)
+    if not photos:
+        print(f"Error: No hay fotos en {args.photos}")
+        return 1
+
+    # Índice del libro antes de empezar: las búsquedas del pipeline solo consultan
+    value_index.get_value_index(doc)
+
+    print(f"Info: Procesando {len(photos)} fotos contra {args.book}...")
+    summary = run_batch(doc, photos, args.output, args.cpu_workers, args.net_workers,
+                        args.top_k, args.blur_threshold)
+    print(f"Info: {summary['photos']} fotos en {summary['seconds']}s "
+          f"({summary['photos_per_second']} fotos/s). Resultados en {args.output}")
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
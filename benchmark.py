@@ -0,0 +1,434 @@
+"""
+Benchmarks de las rutas críticas con libros sintéticos (ReportLab).
+
+Uso:
+    python benchmark.py --pages 300 --output bench.json
+    python benchmark.py --pages 300 --compare bench_anterior.json
+    python benchmark.py --imports   (arranque en frío y costo por rerun)
+
+Genera un libro de circuitos con capítulos, TOC opcional y densidad de
+valores configurable, más un Word, un Excel y una foto de ejercicio, y mide
+load_pdf, generate_chapter_index, search_by_unique_values,
+extract_page_data, converter e image_shield. Los resultados se escriben en
+JSON (con el commit de git) para comparar entre versiones.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+# Unidades que las fuentes base de ReportLab pueden dibujar (Ω no está en latin-1)
+BENCH_UNITS = ["V", "A", "mH", "µF", "nF", "pF", "Hz", "kHz", "W", "kW"]
+BENCH_NUMBERS = ["1", "2.2", "3.3", "4.7", "5", "6.8", "10", "12", "15", "22", "33", "47", "68", "100", "220", "470"]
+
+CHAPTER_TITLES = ["Circuitos resistivos", "Métodos de análisis", "Teoremas de circuitos",
+                  "Amplificadores operacionales", "Capacitores e inductores",
+                  "Circuitos de primer orden", "Circuitos de segundo orden",
+                  "Análisis senoidal", "Potencia de CA", "Circuitos trifásicos"]
+
+def generate_book(path, pages=300, toc=True, values_per_page=12, chapter_every=25, seed=0):
+    """
+    Genera un libro sintético de circuitos en PDF.
+
+    Args:
+        path (str): PDF de salida.
+        pages (int): Número de páginas.
+        toc (bool): Incluir TOC interno (outline). Sin TOC el índice de
+                    capítulos cae al escaneo Regex.
+        values_per_page (int): Valores con unidad por página (densidad).
+        chapter_every (int): Páginas por capítulo.
+        seed (int): Semilla (mismo seed -> mismo libro).
+
+    Returns:
+        dict: {"page": n, "values": [...]} valores de un ejercicio conocido
+              (para buscarlo y comprobar que se encuentra).
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    rng = random.Random(seed)
+    width, height = letter
+    c = canvas.Canvas(path, pagesize=letter)
+    probe_page = pages // 2
+    probe_values = []
+
+    for page_num in range(pages):
+        y = height - 60
+        if page_num % chapter_every == 0:
+            chapter = page_num // chapter_every + 1
+            title = f"Capítulo {chapter}: {CHAPTER_TITLES[(chapter - 1) % len(CHAPTER_TITLES)]}"
+            c.setFont("Helvetica-Bold", 16)
+            c.drawString(60, y, title)
+            if toc:
+                key = f"cap{chapter}"
+                c.bookmarkPage(key)
+                c.addOutlineEntry(title, key, level=0)
+            y -= 30
+
+        c.setFont("Helvetica", 10)
+        values = [f"{rng.choice(BENCH_NUMBERS)} {rng.choice(BENCH_UNITS)}" for _ in range(values_per_page)]
+        if page_num == probe_page:
+            # Como los devolvería el OCR ("10V"); µ no entra en build_flexible_regex
+            probe_values = [v.replace(" ", "") for v in values if v.isascii()][:4]
+        for problem in range(0, len(values), 3):
+            group = values[problem:problem + 3]
+            c.drawString(60, y, f"Problema {page_num + 1}.{problem // 3 + 1}: Determine la corriente "
+                                f"en el circuito con {', '.join(group)}.")
+            y -= 14
+            c.drawString(60, y, "Utilice análisis nodal y verifique la potencia entregada por cada fuente.")
+            y -= 22
+            if y < 60:
+                break
+        c.drawString(width / 2, 30, str(page_num + 1))
+        c.showPage()
+    c.save()
+    return {"page": probe_page, "values": probe_values}
+
+def generate_docx(path, paragraphs=2000, seed=0):
+    """Word sintético con `paragraphs` párrafos de enunciados."""
+    import docx
+
+    rng = random.Random(seed)
+    document = docx.Document()
+    for i in range(paragraphs):
+        values = ", ".join(f"{rng.choice(BENCH_NUMBERS)} {rng.choice(BENCH_UNITS)}" for _ in range(3))
+        document.add_paragraph(f"Ejercicio {i + 1}: calcule la tensión de Thevenin con {values}.")
+    document.save(path)
+
+def generate_xlsx(path, rows=5000, columns=8, seed=0):
+    """Excel sintético de tablas de componentes."""
+    import openpyxl
+
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Componentes"
+    sheet.append([f"Col{c + 1}" for c in range(columns)])
+    for _ in range(rows):
+        sheet.append([f"{rng.choice(BENCH_NUMBERS)}{rng.choice(BENCH_UNITS)}" for _ in range(columns)])
+    workbook.save(path)
+
+def generate_photo(path, book_path, page_number, seed=0):
+    """'Foto' de una página del libro: render + leve giro, ruido y JPEG."""
+    import fitz
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    with fitz.open(book_path) as doc:
+        pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY)
+        gray = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width)
+    h, w = gray.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-2, 2), 1.0)
+    photo = cv2.warpAffine(gray, matrix, (w, h), borderValue=255)
+    photo = np.clip(photo * 0.9 + 15 + rng.normal(0, 6, photo.shape), 0, 255).astype(np.uint8)
+    cv2.imwrite(path, photo, [cv2.IMWRITE_JPEG_QUALITY, 80])
+
+def git_commit():
+    """Commit actual (None si no es un repo git)."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+class BenchmarkRunner:
+    """Mide funciones y acumula resultados (segundos, stdout silenciado)."""
+    def __init__(self, repeat=3, verbose=True):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = []
+
+    def measure(self, name, fn, repeat=None, setup=None, **params):
+        """
+        Ejecuta fn() `repeat` veces (setup() antes de cada una, sin medir).
+
+        Returns:
+            El resultado de la última ejecución de fn.
+        """
+        runs = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                result = fn()
+                runs.append(time.perf_counter() - start)
+        record = {
+            "name": name,
+            "params": params,
+            "runs": [round(r, 6) for r in runs],
+            "min": round(min(runs), 6),
+            "median": round(statistics.median(runs), 6),
+            "mean": round(statistics.mean(runs), 6),
+        }
+        self.results.append(record)
+        if self.verbose:
+            print(f"{name:<45} min {record['min'] * 1000:10.2f} ms   mediana {record['median'] * 1000:10.2f} ms")
+        return result
+
+def reset_caches():
+    """Vacía las cachés en RAM y en disco (para medir en frío)."""
+    import backend
+    import page_store
+    import value_index
+    import component_inventory
+
+    page_store._STORES.clear()
+    page_store._FILE_HASHES.clear()
+    value_index._INDEXES.clear()
+    component_inventory._INVENTORIES.clear()
+    backend.RENDER_CACHE.clear()
+    for directory in (page_store.PAGE_STORE_DIR, backend.CHAPTER_CACHE_DIR, component_inventory.INVENTORY_DIR):
+        shutil.rmtree(directory, ignore_errors=True)
+
+def run_benchmarks(workdir, pages=300, toc=True, values_per_page=12, repeat=3):
+    """
+    Genera los archivos sintéticos en `workdir` y mide todas las rutas.
+
+    Returns:
+        list: Registros de BenchmarkRunner.results.
+    """
+    import backend
+    import converter
+    import search_engine
+    import image_shield
+
+    bench = BenchmarkRunner(repeat)
+    book_path = os.path.join(workdir, "libro.pdf")
+    probe = bench.measure("generate_book", lambda: generate_book(book_path, pages, toc, values_per_page),
+                          repeat=1, pages=pages, toc=toc, values_per_page=values_per_page)
+
+    # --- Libro (PDF) ---
+    doc = bench.measure("load_pdf", lambda: backend.load_pdf(book_path), pages=pages)
+    bench.measure("generate_chapter_index[frio]", lambda: backend.generate_chapter_index(doc),
+                  setup=reset_caches, toc=toc)
+    bench.measure("generate_chapter_index[cache]", lambda: backend.generate_chapter_index(doc))
+
+    keywords = probe["values"]
+    results = bench.measure("search_by_unique_values[frio]",
+                            lambda: search_engine.search_by_unique_values(doc, keywords),
+                            setup=reset_caches, keywords=len(keywords))
+    found = any(p == probe["page"] for p, _ in results[:5])
+    bench.measure("search_by_unique_values[indice]",
+                  lambda: search_engine.search_by_unique_values(doc, keywords), repeat=max(repeat, 10))
+    if not found:
+        print(f"Advertencia: La página de prueba {probe['page']} no quedó en el top 5.")
+
+    def clear_renders():
+        backend.RENDER_CACHE.clear()
+    bench.measure("extract_page_data[render]", lambda: backend.extract_page_data(doc, probe["page"]),
+                  setup=clear_renders, zoom=2.0)
+    bench.measure("extract_page_data[cache]", lambda: backend.extract_page_data(doc, probe["page"]),
+                  repeat=max(repeat, 10))
+
+    # --- Conversores ---
+    docx_path = os.path.join(workdir, "enunciados.docx")
+    xlsx_path = os.path.join(workdir, "componentes.xlsx")
+    photo_path = os.path.join(workdir, "foto.jpg")
+    generate_docx(docx_path)
+    generate_xlsx(xlsx_path)
+    generate_photo(photo_path, book_path, probe["page"])
+
+    def remove_conversions():
+        for name in os.listdir(workdir):
+            if ".converted" in name:
+                os.remove(os.path.join(workdir, name))
+
+    for path, ext in ((docx_path, "docx"), (xlsx_path, "xlsx"), (photo_path, "jpg")):
+        bench.measure(f"convert_to_pdf[{ext}]", lambda: converter.convert_to_pdf(path, ext),
+                      setup=remove_conversions, size_bytes=os.path.getsize(path))
+        bench.measure(f"extract_text_pages[{ext}]", lambda: converter.extract_text_pages(path, ext))
+
+    # --- image_shield ---
+    with open(photo_path, "rb") as f:
+        photo_bytes = f.read()
+    bench.measure("detect_blur", lambda: image_shield.detect_blur(photo_bytes), repeat=max(repeat, 5))
+    bench.measure("detect_blur_batch[16]", lambda: image_shield.detect_blur_batch([photo_bytes] * 16))
+    bench.measure("clean_image", lambda: image_shield.clean_image(photo_bytes), repeat=max(repeat, 5))
+
+    def scan_pipeline():
+        scan = image_shield.ScanImage(photo_bytes)
+        scan.blur()
+        scan.orientation()
+        scan.perceptual_hash()
+        scan.content_features()
+        return scan.to_pil()
+    bench.measure("ScanImage[blur+orientacion+hash+limpieza]", scan_pipeline, repeat=max(repeat, 5))
+
+    doc.close()
+    return bench.results
+
+# Diferencias absolutas menores a esto (segundos) se consideran ruido
+COMPARE_MIN_DELTA = 0.001
+
+# Módulos que app.py importa al arrancar (modo producción)
+STARTUP_MODULES = ["backend", "search_engine", "ai_chat", "converter", "page_store", "prefetch",
+                   "artifact_store", "signature_cache", "model_client", "metrics", "component_inventory",
+                   "document_pool"]
+# Dependencias pesadas que antes se importaban al arrancar y ahora son diferidas
+HEAVY_DEPENDENCIES = ["google.generativeai", "pandas", "openpyxl", "cv2",
+                      "reportlab.pdfgen.canvas", "lxml.etree"]
+# Lo que app.py ejecutaba en cada rerun antes del modo producción
+LEGACY_RELOADED = ["backend", "search_engine", "ai_chat", "converter", "image_shield", "page_store"]
+
+def _run_timing_script(code):
+    """Ejecuta `code` en un intérprete nuevo y retorna el JSON de su última línea."""
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def import_report(repeat=3):
+    """
+    Costo de arranque y de cada interacción (rerun), antes y ahora.
+
+    Cada import se mide en un intérprete nuevo (sin módulos en caché):
+    - arranque actual: los módulos de la app, con dependencias diferidas.
+    - arranque anterior: lo mismo + las dependencias pesadas que antes se
+      importaban al arrancar.
+    - cada dependencia pesada por separado (lo que paga la primera
+      interacción que la usa).
+    - rerun anterior: importlib.reload de LEGACY_RELOADED + initialize_ai;
+      en modo producción ese costo es 0.
+
+    Returns:
+        list: Registros con el mismo formato que BenchmarkRunner.results.
+    """
+    def timed_import(modules):
+        code = (
+            "import time, sys, json\n"
+            "t = time.perf_counter()\n"
+            f"for m in {modules!r}: __import__(m)\n"
+            "elapsed = time.perf_counter() - t\n"
+            f"print(json.dumps({{'seconds': elapsed, 'loaded': [d for d in {HEAVY_DEPENDENCIES!r} if d in sys.modules]}}))"
+        )
+        return _run_timing_script(code)
+
+    def record(name, runs, **params):
+        return {"name": name, "params": params, "runs": [round(r, 6) for r in runs],
+                "min": round(min(runs), 6), "median": round(statistics.median(runs), 6),
+                "mean": round(statistics.mean(runs), 6)}
+
+    results = []
+    startup = [timed_import(STARTUP_MODULES) for _ in range(repeat)]
+    results.append(record("import[arranque]", [r["seconds"] for r in startup],
+                          heavy_loaded=startup[-1]["loaded"]))
+    eager = [timed_import(STARTUP_MODULES + ["image_shield"] + HEAVY_DEPENDENCIES) for _ in range(repeat)]
+    results.append(record("import[arranque_anterior]", [r["seconds"] for r in eager]))
+    for dependency in HEAVY_DEPENDENCIES:
+        runs = [timed_import([dependency])["seconds"] for _ in range(repeat)]
+        results.append(record(f"import[{dependency}]", runs))
+
+    rerun_code = (
+        "import time, json, importlib\n"
+        f"modules = [importlib.import_module(m) for m in {LEGACY_RELOADED!r}]\n"
+        "import ai_chat\n"
+        "runs = []\n"
+        "for _ in range(5):\n"
+        "    t = time.perf_counter()\n"
+        "    for m in modules: importlib.reload(m)\n"
+        "    ai_chat.initialize_ai()\n"
+        "    runs.append(time.perf_counter() - t)\n"
+        "print(json.dumps({'runs': runs}))"
+    )
+    results.append(record("rerun[reload+initialize_ai]", _run_timing_script(rerun_code)["runs"]))
+
+    by_name = {r["name"]: r for r in results}
+    now = by_name["import[arranque]"]["median"]
+    before = by_name["import[arranque_anterior]"]["median"]
+    print(f"{'Arranque (producción)':<40} {now * 1000:10.1f} ms   pesadas cargadas: {startup[-1]['loaded'] or 'ninguna'}")
+    print(f"{'Arranque (imports anteriores)':<40} {before * 1000:10.1f} ms   ahorro {(before - now) * 1000:.1f} ms")
+    for dependency in HEAVY_DEPENDENCIES:
+        print(f"{'  diferido: ' + dependency:<40} {by_name[f'import[{dependency}]']['median'] * 1000:10.1f} ms (primer uso)")
+    rerun = by_name["rerun[reload+initialize_ai]"]["median"]
+    print(f"{'Rerun (antes: reload + initialize_ai)':<40} {rerun * 1000:10.1f} ms   ahora 0 ms por interacción")
+    return results
+
+def compare(results, baseline_path, tolerance=0.10, config=None):
+    """
+    Imprime la variación de la mediana frente a un JSON anterior.
+
+    Returns:
+        int: Cantidad de regresiones (más lento que `tolerance` y que
+             COMPARE_MIN_DELTA en valor absoluto).
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    baseline = {r["name"]: r for r in payload["results"]}
+    if config is not None and payload.get("config") != config:
+        print(f"Advertencia: Configuración distinta a la de referencia ({payload.get('config')}).")
+    print(f"\nComparación con {baseline_path} (commit {payload.get('commit')}, mediana):")
+    regressions = 0
+    for record in results:
+        old = baseline.get(record["name"])
+        if not old or not old["median"]:
+            continue
+        change = record["median"] / old["median"] - 1
+        flag = ""
+        if change > tolerance and record["median"] - old["median"] > COMPARE_MIN_DELTA:
+            flag = "  <-- REGRESIÓN"
+            regressions += 1
+        print(f"{record['name']:<45} {change:+8.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks con libros sintéticos.")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--no-toc", action="store_true", help="Libro sin TOC (índice por Regex)")
+    parser.add_argument("--values-per-page", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="JSON de una corrida anterior")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Variación tolerada al comparar")
+    parser.add_argument("--imports", action="store_true",
+                        help="Solo el reporte de tiempos de import (arranque y rerun)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="circuit-bench-")
+    # Caché aislada: se define antes de importar los módulos del proyecto
+    os.environ["CIRCUIT_VERIFIER_CACHE"] = os.path.join(workdir, "cache")
+    try:
+        if args.imports:
+            results = import_report(args.repeat)
+        else:
+            results = run_benchmarks(workdir, args.pages, not args.no_toc, args.values_per_page, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {"pages": args.pages, "toc": not args.no_toc,
+              "values_per_page": args.values_per_page, "repeat": args.repeat,
+              "imports": args.imports}
+    payload = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    print(f"\nInfo: Resultados guardados en {args.output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance, config) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
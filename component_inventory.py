@@ -0,0 +1,294 @@
+"""
+Inventario de componentes de un libro completo: todos los valores con unidad
+(units.find_values) extraídos en una sola pasada y guardados por columnas.
+
+Una fila por (página, valor, unidad) con el offset de la primera aparición
+en el texto normalizado de la página y el número de apariciones. Las
+columnas se guardan como archivos .npy y se cargan memory-mapped, de modo
+que la app, el índice de búsqueda (value_index) y el análisis offline leen
+el mismo inventario precalculado sin volver a recorrer el texto.
+
+Uso offline:
+    python component_inventory.py libro.pdf [--csv inventario.csv]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import page_store
+import units
+
+INVENTORY_DIR = os.path.join(page_store.CACHE_DIR, "inventory")
+INVENTORY_VERSION = 2 # Sigue a page_store.STORE_VERSION
+
+MAX_INVENTORIES_IN_MEMORY = 4
+
+# Columnas (nombre -> dtype). La unidad se guarda como índice en units.BASE_UNITS.
+COLUMNS = {
+    "page": np.int32,
+    "value": np.float64,
+    "unit": np.int8,
+    "offset": np.int32,
+    "count": np.int32,
+}
+
+if "_INVENTORIES" not in globals():
+    _INVENTORIES = OrderedDict()
+    _INVENTORY_LOCK = threading.Lock()
+
+class ComponentInventory:
+    """
+    Inventario por columnas, ordenado por (página, offset).
+
+    Atributos page, value, unit, offset, count: arrays alineados (una fila
+    por valor distinto de cada página). Al cargarse desde disco son
+    memory-mapped (solo lectura).
+    """
+    def __init__(self, doc_hash, page_count, columns):
+        self.doc_hash = doc_hash
+        self.page_count = page_count
+        self.page = columns["page"]
+        self.value = columns["value"]
+        self.unit = columns["unit"]
+        self.offset = columns["offset"]
+        self.count = columns["count"]
+        # Fila inicial de cada página (las filas están ordenadas por página)
+        self._page_ptr = np.searchsorted(self.page, np.arange(page_count + 1), side="left")
+
+    def __len__(self):
+        return len(self.page)
+
+    @classmethod
+    def build(cls, store):
+        """
+        Extrae el inventario del texto normalizado de un PageStore en una
+        sola pasada sobre el libro concatenado.
+        """
+        separator = "\x00" # No es \w ni dígito: ningún valor cruza de página
+        joined = separator.join(store.normalized)
+        page_starts = np.cumsum([0] + [len(text) + 1 for text in store.normalized[:-1]], dtype=np.int64)
+        unit_codes = {unit: code for code, unit in enumerate(units.BASE_UNITS)}
+
+        values, unit_column, starts = [], [], []
+        for value, unit, start, _ in units.find_values(joined):
+            values.append(value)
+            unit_column.append(unit_codes[unit])
+            starts.append(start)
+
+        starts = np.array(starts, dtype=np.int64)
+        pages = (np.searchsorted(page_starts, starts, side="right") - 1).astype(np.int32)
+        offsets = (starts - page_starts[pages]).astype(np.int32)
+        values = np.array(values, dtype=np.float64)
+        unit_column = np.array(unit_column, dtype=np.int8)
+
+        # Agrupar apariciones repetidas de (página, unidad, valor): se conserva
+        # el primer offset y se cuentan todas
+        order = np.lexsort((offsets, values, unit_column, pages))
+        pages, unit_column, values, offsets = pages[order], unit_column[order], values[order], offsets[order]
+        first = np.ones(len(pages), dtype=bool)
+        first[1:] = (pages[1:] != pages[:-1]) | (unit_column[1:] != unit_column[:-1]) | (values[1:] != values[:-1])
+        group_starts = np.flatnonzero(first)
+        counts = np.diff(np.append(group_starts, len(pages))).astype(np.int32)
+
+        # Orden final por (página, offset): lectura natural del libro
+        columns = {
+            "page": pages[group_starts], "value": values[group_starts],
+            "unit": unit_column[group_starts], "offset": offsets[group_starts], "count": counts,
+        }
+        reading_order = np.lexsort((columns["offset"], columns["page"]))
+        columns = {name: columns[name][reading_order].astype(dtype) for name, dtype in COLUMNS.items()}
+        return cls(store.doc_hash, store.page_count, columns)
+
+    def save(self, directory=INVENTORY_DIR):
+        """Persiste las columnas (.npy) y los metadatos en un directorio por documento."""
+        path = _inventory_path(self.doc_hash, directory)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": INVENTORY_VERSION, "page_count": self.page_count,
+                       "units": units.BASE_UNITS, "rows": len(self)}, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path) # Directorio completo o nada
+
+    @classmethod
+    def load(cls, doc_hash, directory=INVENTORY_DIR):
+        """Carga el inventario memory-mapped. Retorna None si no existe o es inválido."""
+        path = _inventory_path(doc_hash, directory)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != INVENTORY_VERSION or meta.get("units") != units.BASE_UNITS:
+                return None
+            columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+            return cls(doc_hash, meta["page_count"], columns)
+        except Exception as e:
+            print(f"Advertencia: Inventario de componentes corrupto ({path}): {e}")
+            return None
+
+    def unit_name(self, code):
+        return units.BASE_UNITS[code]
+
+    def unit_rows(self, unit):
+        """
+        Filas de una unidad.
+
+        Returns:
+            tuple: (values, pages, counts) como arrays alineados; vacíos si
+                   el libro no tiene valores de esa unidad.
+        """
+        if unit not in units.BASE_UNITS:
+            empty = np.empty(0)
+            return empty, empty.astype(np.int32), empty.astype(np.int32)
+        mask = self.unit == units.BASE_UNITS.index(unit)
+        return np.asarray(self.value[mask]), np.asarray(self.page[mask]), np.asarray(self.count[mask])
+
+    def page_components(self, page_number):
+        """
+        Componentes de una página en orden de lectura.
+
+        Returns:
+            list: Dicts {value, unit, text, offset, count} (text = '4.7kΩ').
+        """
+        if page_number < 0 or page_number >= self.page_count:
+            return []
+        first, last = self._page_ptr[page_number], self._page_ptr[page_number + 1]
+        components = []
+        for row in range(first, last):
+            unit = self.unit_name(int(self.unit[row]))
+            value = float(self.value[row])
+            components.append({
+                "value": value, "unit": unit, "text": units.format_value(value, unit),
+                "offset": int(self.offset[row]), "count": int(self.count[row]),
+            })
+        return components
+
+    def to_dataframe(self):
+        """Inventario completo como DataFrame (análisis offline)."""
+        import pandas as pd # Import diferido: pandas solo hace falta para análisis
+
+        return pd.DataFrame({
+            "page": np.asarray(self.page) + 1,
+            "value": np.asarray(self.value),
+            "unit": [units.BASE_UNITS[code] for code in self.unit],
+            "offset": np.asarray(self.offset),
+            "count": np.asarray(self.count),
+        })
+
+def _inventory_path(doc_hash, directory):
+    return os.path.join(directory, doc_hash)
+
+def get_store_inventory(store):
+    """
+    Inventario de un PageStore ya cargado.
+    Orden de búsqueda: RAM -> disco (memory-mapped) -> extracción (y persistencia).
+    """
+    with _INVENTORY_LOCK:
+        inventory = _INVENTORIES.get(store.doc_hash)
+        if inventory is not None:
+            _INVENTORIES.move_to_end(store.doc_hash)
+            return inventory
+
+    inventory = ComponentInventory.load(store.doc_hash)
+    if inventory is None:
+        import metrics # Import diferido: metrics depende de CACHE_DIR
+
+        with metrics.timed("component_inventory", pages=store.page_count) as event:
+            inventory = ComponentInventory.build(store)
+            event["rows"] = len(inventory)
+        try:
+            inventory.save()
+            # Releer memory-mapped: el array en RAM se libera
+            inventory = ComponentInventory.load(store.doc_hash) or inventory
+        except Exception as e:
+            print(f"Advertencia: No se pudo persistir el inventario de componentes: {e}")
+
+    with _INVENTORY_LOCK:
+        _INVENTORIES[store.doc_hash] = inventory
+        while len(_INVENTORIES) > MAX_INVENTORIES_IN_MEMORY:
+            _INVENTORIES.popitem(last=False)
+    return inventory
+
+def get_cached_inventory(doc):
+    """
+    Inventario del documento solo si su texto ya está en caché (RAM o disco);
+    no extrae el libro. Retorna None si el texto aún no fue extraído.
+    """
+    store = page_store.get_cached_page_store(doc)
+    if store is None:
+        return None
+    return get_store_inventory(store)
+
+def text_components(text):
+    """
+    Componentes de un texto suelto (ej: la página visible), con el mismo
+    formato que ComponentInventory.page_components.
+    """
+    components = OrderedDict()
+    for value, unit, start, _ in units.find_values(text):
+        component = components.get((value, unit))
+        if component is None:
+            components[(value, unit)] = {
+                "value": value, "unit": unit, "text": units.format_value(value, unit),
+                "offset": start, "count": 1,
+            }
+        else:
+            component["count"] += 1
+    return list(components.values())
+
+def get_inventory(doc, workers=None):
+    """
+    Inventario de componentes del documento.
+
+    Args:
+        doc (fitz.Document): Documento cargado.
+        workers (int, optional): Procesos para extraer el texto si aún no está en caché.
+
+    Returns:
+        ComponentInventory: Inventario del libro completo.
+    """
+    return get_store_inventory(page_store.get_page_store(doc, workers))
+
+def main(argv=None):
+    import backend
+
+    parser = argparse.ArgumentParser(description="Inventario de componentes de un libro.")
+    parser.add_argument("book", help="Libro (pdf, docx, xlsx...)")
+    parser.add_argument("--csv", help="Exportar el inventario completo a CSV")
+    parser.add_argument("--top", type=int, default=10, help="Valores más frecuentes por unidad")
+    args = parser.parse_args(argv)
+
+    doc = backend.load_document(args.book, os.path.splitext(args.book)[1])
+    if doc is None:
+        print(f"Error: No se pudo cargar el libro {args.book}")
+        return 1
+
+    inventory = get_inventory(doc)
+    print(f"Info: {len(inventory)} filas en {inventory.page_count} páginas.")
+    for unit in units.BASE_UNITS:
+        values, pages, counts = inventory.unit_rows(unit)
+        if len(values) == 0:
+            continue
+        distinct, inverse = np.unique(values, return_inverse=True)
+        totals = np.bincount(inverse, weights=counts)
+        top = np.argsort(-totals, kind="stable")[:args.top]
+        listed = ", ".join(f"{units.format_value(distinct[i], unit)} ({int(totals[i])})" for i in top)
+        print(f"  {unit}: {int(counts.sum())} apariciones, {len(distinct)} valores distintos. {listed}")
+
+    if args.csv:
+        inventory.to_dataframe().to_csv(args.csv, index=False)
+        print(f"Info: Inventario exportado a {args.csv}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,116 @@
 import os
 import io
+import time
+import textwrap
+import zipfile
 from PIL import Image
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-import docx
-import pandas as pd
 import tempfile
+import metrics
 
-def convert_to_pdf(source_path, file_extension):
+# reportlab, lxml, openpyxl y pandas se importan dentro de cada conversión:
+# la app arranca sin cargarlos y solo los paga quien convierte ese formato.
+
+# Versión del formato de salida: forma parte del nombre del PDF convertido,
+# así un cambio de maquetación no reutiliza conversiones viejas.
+CONVERSION_VERSION = 3 # 3: celdas de Excel partidas en líneas en vez de recortadas
+
+# Maquetación de las páginas de texto (carta, márgenes de 40pt)
+PAGE_MARGIN = 40
+DOCX_FONT = ("Helvetica", 10)
+EXCEL_FONT = ("Courier", 8) # Monoespaciada para tablas
+EXCEL_COLUMN_WIDTH = 14
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def convert_to_pdf(source_path, file_extension, progress=None):
     """
-    Convierte archivos (docx, xlsx, png, jpg) a un PDF temporal.
+    Convierte archivos (docx, xlsx, png, jpg) a un PDF junto al original.
+    Si la conversión ya existe (archivo guardado por contenido) se reutiliza.
     Retorna la ruta del PDF generado.
+
+    Word y Excel se convierten en streaming (ver _write_text_pdf): el
+    callback opcional progress(paginas_listas, segundos) se llama al cerrar
+    cada página, lo que permite medir el tiempo hasta la primera página.
     """
     file_extension = file_extension.lower().replace('.', '')
     
     if file_extension in ['pdf']:
         return source_path # No hacer nada si ya es PDF
         
-    output_pdf_path = source_path + ".converted.pdf"
+    output_pdf_path = source_path + f".converted-v{CONVERSION_VERSION}.pdf"
+    if os.path.exists(output_pdf_path):
+        return output_pdf_path
     
+    # Escribir a un temporal propio y renombrar: nunca queda un PDF a medias,
+    # ni siquiera si dos sesiones convierten el mismo archivo a la vez
+    fd, tmp_pdf_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_pdf_path)),
+                                        prefix=os.path.basename(output_pdf_path) + ".", suffix=".tmp")
+    os.close(fd)
     try:
-        if file_extension in ['png', 'jpg', 'jpeg']:
-            _image_to_pdf(source_path, output_pdf_path)
-            
-        elif file_extension in ['docx', 'doc']:
-            _docx_to_pdf(source_path, output_pdf_path)
-            
-        elif file_extension in ['xlsx', 'xls']:
-            _excel_to_pdf(source_path, output_pdf_path)
-            
-        else:
-            return None # Formato no soportado
-            
+        with metrics.timed("conversion", format=file_extension) as event:
+            if file_extension in ['png', 'jpg', 'jpeg']:
+                _image_to_pdf(source_path, tmp_pdf_path)
+                event["pages"] = 1
+                
+            elif file_extension in ['docx', 'doc']:
+                event["pages"] = _docx_to_pdf(source_path, tmp_pdf_path, progress)
+                
+            elif file_extension in ['xlsx', 'xls']:
+                event["pages"] = _excel_to_pdf(source_path, tmp_pdf_path, progress)
+                
+            else:
+                return None # Formato no soportado
+                
+            os.replace(tmp_pdf_path, output_pdf_path)
+            event["bytes"] = os.path.getsize(output_pdf_path)
         return output_pdf_path
         
     except Exception as e:
         print(f"Error en conversión: {e}")
         return None
+    finally:
+        if os.path.exists(tmp_pdf_path):
+            os.remove(tmp_pdf_path)
+
+def extract_text_pages(source_path, file_extension):
+    """
+    Texto por página de un docx/xlsx/imagen, sin generar el PDF.
+
+    Usa los mismos generadores de líneas y la misma paginación que
+    convert_to_pdf, así la página N del texto corresponde a la página N del
+    PDF si más adelante se genera para visualizarlo.
+
+    Returns:
+        list: Texto de cada página. None si el formato no es soportado.
+    """
+    file_extension = file_extension.lower().replace('.', '')
+
+    if file_extension in ['png', 'jpg', 'jpeg']:
+        return [""] # Una página, sin texto extraíble
+    elif file_extension in ['docx', 'doc']:
+        lines, font = iter_docx_paragraphs(source_path), DOCX_FONT
+    elif file_extension in ['xlsx', 'xls']:
+        lines, font = iter_excel_lines(source_path), EXCEL_FONT
+    else:
+        return None # Formato no soportado
+
+    max_lines = lines_per_page(font[1])
+    pages = []
+    current = []
+    with metrics.timed("text_extraction", source=file_extension) as event:
+        for line in lines:
+            if len(current) == max_lines:
+                pages.append("\n".join(current))
+                current = []
+            current.append(line) # Texto original: conserva Ω, µ... que el PDF pierde
+        pages.append("\n".join(current)) # Igual que el PDF: siempre al menos una página
+        event["pages"] = len(pages)
+    return pages
 
 def _image_to_pdf(image_path, output_path):
     """Convierte una imagen en una página PDF."""
+    from reportlab.pdfgen import canvas
+
     img = Image.open(image_path)
     c = canvas.Canvas(output_path)
     
@@ -51,56 +121,162 @@ def _image_to_pdf(image_path, output_path):
     c.drawImage(image_path, 0, 0, width=img_width, height=img_height)
     c.save()
 
-def _docx_to_pdf(docx_path, output_path):
-    """Extrae texto de Word y crea un PDF simple."""
-    doc = docx.Document(docx_path)
-    c = canvas.Canvas(output_path, pagesize=letter)
+def lines_per_page(font_size):
+    """
+    Líneas de texto que caben en una página carta con el interlineado por
+    defecto de ReportLab (1.2 x tamaño de fuente).
+    """
+    from reportlab.lib.pagesizes import letter
+
+    _, height = letter
+    leading = font_size * 1.2
+    usable = (height - PAGE_MARGIN) - PAGE_MARGIN
+    return int(usable // leading) + 1
+
+def _clean_line(text):
+    """Limpia caracteres no compatibles con las fuentes base del PDF."""
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+def _write_text_pdf(lines, output_path, font, progress=None):
+    """
+    Escribe líneas de texto en un PDF a medida que llegan (sin acumularlas).
+
+    Args:
+        lines (iterable): Generador de líneas ya formateadas.
+        output_path (str): Ruta del PDF de salida.
+        font (tuple): (nombre_fuente, tamaño).
+        progress (callable, optional): progress(paginas_listas, segundos).
+
+    Returns:
+        int: Número de páginas escritas.
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    font_name, font_size = font
+    max_lines = lines_per_page(font_size)
     width, height = letter
-    
-    text_object = c.beginText(40, height - 40)
-    text_object.setFont("Helvetica", 10)
-    
-    for para in doc.paragraphs:
-        # Manejo básico de saltos de página si el texto es muy largo
-        if text_object.getY() < 40:
+    c = canvas.Canvas(output_path, pagesize=letter)
+    start = time.perf_counter()
+
+    def new_text_object():
+        text_object = c.beginText(PAGE_MARGIN, height - PAGE_MARGIN)
+        text_object.setFont(font_name, font_size)
+        return text_object
+
+    text_object = new_text_object()
+    pages = 0
+    lines_on_page = 0
+    for line in lines:
+        if lines_on_page == max_lines:
             c.drawText(text_object)
             c.showPage()
-            text_object = c.beginText(40, height - 40)
-            text_object.setFont("Helvetica", 10)
-            
-        # Limpiar texto de caracteres no compatibles
-        clean_text = para.text.encode('latin-1', 'replace').decode('latin-1')
-        text_object.textLine(clean_text)
-        
-    c.drawText(text_object)
-    c.save()
+            pages += 1
+            if pages == 1:
+                print(f"Info: Primera página lista en {time.perf_counter() - start:.3f}s")
+            if progress:
+                progress(pages, time.perf_counter() - start)
+            text_object = new_text_object()
+            lines_on_page = 0
+        text_object.textLine(_clean_line(line))
+        lines_on_page += 1
 
-def _excel_to_pdf(excel_path, output_path):
-    """Convierte hojas de Excel a PDF (texto plano de tablas)."""
-    dfs = pd.read_excel(excel_path, sheet_name=None) # Leer todas las hojas
-    c = canvas.Canvas(output_path, pagesize=letter)
-    width, height = letter
-    
-    text_object = c.beginText(40, height - 40)
-    text_object.setFont("Courier", 8) # Fuente monoespaciada para tablas
-    
-    for sheet_name, df in dfs.items():
-        text_object.textLine(f"--- Hoja: {sheet_name} ---")
-        
-        # Convertir dataframe a string
-        table_str = df.to_string()
-        
-        for line in table_str.split('\n'):
-            if text_object.getY() < 40:
-                c.drawText(text_object)
-                c.showPage()
-                text_object = c.beginText(40, height - 40)
-                text_object.setFont("Courier", 8)
-            
-            clean_line = line.encode('latin-1', 'replace').decode('latin-1')
-            text_object.textLine(clean_line)
-            
-        text_object.textLine("") # Espacio entre hojas
-        
     c.drawText(text_object)
     c.save()
+    pages += 1
+    if progress:
+        progress(pages, time.perf_counter() - start)
+    return pages
+
+def iter_docx_paragraphs(docx_path):
+    """
+    Texto de los párrafos del cuerpo de un .docx, en orden y en streaming.
+
+    Lee word/document.xml con iterparse y libera cada párrafo tras procesarlo,
+    así la memoria no crece con el tamaño del documento. Igual que
+    docx.Document(...).paragraphs, solo incluye párrafos de primer nivel
+    (no los que están dentro de tablas).
+    """
+    from lxml import etree
+
+    body_tag = f"{_WORD_NS}body"
+    with zipfile.ZipFile(docx_path) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            for _, elem in etree.iterparse(xml_file, events=("end",), tag=f"{_WORD_NS}p"):
+                parent = elem.getparent()
+                if parent is None or parent.tag != body_tag:
+                    continue
+                parts = []
+                for node in elem.iter(f"{_WORD_NS}t", f"{_WORD_NS}tab", f"{_WORD_NS}br", f"{_WORD_NS}cr"):
+                    if node.tag == f"{_WORD_NS}t":
+                        parts.append(node.text or "")
+                    elif node.tag == f"{_WORD_NS}tab":
+                        parts.append("\t")
+                    else:
+                        parts.append("\n")
+                yield "".join(parts)
+                # Liberar el párrafo y los hermanos ya procesados
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+def iter_excel_lines(excel_path):
+    """
+    Líneas de texto de todas las hojas de un Excel, fila por fila.
+
+    .xlsx se lee con openpyxl en modo read-only (streaming). .xls no es
+    soportado por openpyxl y se lee con pandas como antes.
+    """
+    if excel_path.lower().endswith(".xls"):
+        import pandas as pd
+        dfs = pd.read_excel(excel_path, sheet_name=None) # Leer todas las hojas
+        for sheet_name, df in dfs.items():
+            yield f"--- Hoja: {sheet_name} ---"
+            for line in df.to_string().split('\n'):
+                yield line
+            yield "" # Espacio entre hojas
+        return
+
+    import openpyxl
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"--- Hoja: {sheet.title} ---"
+            for row_num, row in enumerate(sheet.iter_rows(values_only=True)):
+                # Primera fila = encabezados (igual que pandas), sin número de fila
+                prefix = " " * 6 if row_num == 0 else f"{row_num - 1:<6}"
+                for line_num, line in enumerate(_format_row(row)):
+                    yield (prefix if line_num == 0 else " " * 6) + line
+            yield "" # Espacio entre hojas
+    finally:
+        workbook.close()
+
+def _format_row(values):
+    """
+    Formatea una fila en columnas de ancho fijo.
+    Las celdas largas se parten por palabras en varias líneas (sin recortar:
+    el texto completo llega al PDF y al índice de búsqueda).
+
+    Returns:
+        list: Líneas de la fila (al menos una).
+    """
+    columns = []
+    for value in values:
+        text = "" if value is None else str(value)
+        columns.append(textwrap.wrap(text, EXCEL_COLUMN_WIDTH - 1, break_on_hyphens=False) or [""])
+
+    height = max((len(chunks) for chunks in columns), default=1)
+    lines = []
+    for line_num in range(height):
+        cells = [(chunks[line_num] if line_num < len(chunks) else "").ljust(EXCEL_COLUMN_WIDTH)
+                 for chunks in columns]
+        lines.append("".join(cells).rstrip())
+    return lines
+
+def _docx_to_pdf(docx_path, output_path, progress=None):
+    """Extrae texto de Word y crea un PDF simple (streaming)."""
+    return _write_text_pdf(iter_docx_paragraphs(docx_path), output_path, DOCX_FONT, progress)
+
+def _excel_to_pdf(excel_path, output_path, progress=None):
+    """Convierte hojas de Excel a PDF (texto plano de tablas, streaming)."""
+    return _write_text_pdf(iter_excel_lines(excel_path), output_path, EXCEL_FONT, progress)
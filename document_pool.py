@@ -0,0 +1,220 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import fitz  # PyMuPDF
+
+import page_store
+import metrics
+
+# fitz.Document no es thread-safe: cada operación toma prestado un handle
+# propio del archivo en vez de compartir uno entre sesiones. PyMuPDF no suelta
+# el GIL, así que más handles no renderizan en paralelo: con 2 por archivo un
+# render corto de una sesión se intercala con la extracción larga de otra
+# (entre llamadas a PyMuPDF) sin esperar a que termine. Cada handle extra
+# cuesta la memoria de un xref/árbol de páginas parseado.
+POOL_HANDLES_PER_FILE = int(os.environ.get("CIRCUIT_VERIFIER_POOL_HANDLES", 2))
+POOL_MAX_OPEN = int(os.environ.get("CIRCUIT_VERIFIER_POOL_MAX_OPEN", 4 * POOL_HANDLES_PER_FILE))
+
+class DocumentPool:
+    """
+    Pool acotado de handles fitz.Document, agrupados por ruta de archivo.
+
+    - acquire/release (o lease): un handle exclusivo mientras dura la
+      operación. Si el archivo ya tiene POOL_HANDLES_PER_FILE abiertos, se
+      espera a que otro hilo devuelva uno.
+    - Handles libres en orden LRU: al llegar a POOL_MAX_OPEN se cierra
+      (close()) el libre más antiguo de otro archivo.
+    - retain/release_file: referencias de las sesiones que usan un archivo.
+      Cuando la última se suelta, sus handles libres se cierran y los que
+      están prestados se cierran al devolverse.
+    """
+    def __init__(self, handles_per_file=POOL_HANDLES_PER_FILE, max_open=POOL_MAX_OPEN):
+        self.handles_per_file = max(1, handles_per_file)
+        self.max_open = max(self.handles_per_file, max_open)
+        self._cond = threading.Condition()
+        self._idle = OrderedDict() # id(handle) -> (ruta, handle), más antiguo primero
+        self._open = {} # ruta -> handles abiertos (prestados + libres)
+        self._refs = {} # ruta -> sesiones que lo usan
+        self._total_open = 0
+
+    def retain(self, path):
+        """
+        Registra una sesión que usa el archivo. Mientras tenga referencias,
+        artifact_store.enforce_size_cap no lo borra.
+        """
+        path = os.path.abspath(path)
+        with self._cond:
+            self._refs[path] = self._refs.get(path, 0) + 1
+
+    def is_retained(self, path):
+        """Indica si alguna sesión usa el archivo."""
+        with self._cond:
+            return os.path.abspath(path) in self._refs
+
+    def release_file(self, path):
+        """Suelta la referencia de una sesión; sin referencias, cierra sus handles libres."""
+        path = os.path.abspath(path)
+        with self._cond:
+            remaining = self._refs.get(path, 0) - 1
+            if remaining > 0:
+                self._refs[path] = remaining
+                return
+            self._refs.pop(path, None)
+            for key, (idle_path, handle) in list(self._idle.items()):
+                if idle_path == path:
+                    del self._idle[key]
+                    self._close_locked(idle_path, handle)
+            self._cond.notify_all()
+
+    def acquire(self, path):
+        """Handle exclusivo del archivo (lo abre si hace falta y hay cupo)."""
+        path = os.path.abspath(path)
+        with self._cond:
+            while True:
+                for key, (idle_path, handle) in self._idle.items():
+                    if idle_path == path:
+                        del self._idle[key]
+                        return handle
+                if self._open.get(path, 0) < self.handles_per_file:
+                    if self._total_open < self.max_open:
+                        # Cupo reservado; fitz.open fuera del lock
+                        self._open[path] = self._open.get(path, 0) + 1
+                        self._total_open += 1
+                        break
+                    if self._idle:
+                        idle_path, handle = self._idle.popitem(last=False)[1]
+                        self._close_locked(idle_path, handle)
+                        metrics.incr("document_pool.evicted")
+                        continue
+                self._cond.wait()
+
+        try:
+            handle = fitz.open(path)
+        except Exception:
+            with self._cond:
+                self._forget_locked(path)
+                self._cond.notify_all()
+            raise
+        metrics.incr("document_pool.opened")
+        return handle
+
+    def release(self, path, handle):
+        """Devuelve un handle al pool (o lo cierra si ya nadie usa el archivo)."""
+        path = os.path.abspath(path)
+        with self._cond:
+            if path in self._refs:
+                self._idle[id(handle)] = (path, handle)
+            else:
+                self._close_locked(path, handle)
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, path):
+        """Context manager: handle exclusivo durante el bloque."""
+        handle = self.acquire(path)
+        try:
+            yield handle
+        finally:
+            self.release(path, handle)
+
+    def close_all(self):
+        """Cierra todos los handles libres (los prestados se cierran al devolverse)."""
+        with self._cond:
+            self._refs.clear()
+            while self._idle:
+                path, handle = self._idle.popitem(last=False)[1]
+                self._close_locked(path, handle)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "files": len(self._open),
+                "open": self._total_open,
+                "idle": len(self._idle),
+                "leased": self._total_open - len(self._idle),
+                "sessions": sum(self._refs.values()),
+            }
+
+    def _close_locked(self, path, handle):
+        try:
+            handle.close()
+        except Exception as e:
+            print(f"Advertencia: Error al cerrar {path}: {e}")
+        self._forget_locked(path)
+
+    def _forget_locked(self, path):
+        self._total_open -= 1
+        remaining = self._open.get(path, 0) - 1
+        if remaining > 0:
+            self._open[path] = remaining
+        else:
+            self._open.pop(path, None)
+
+# Pool compartido por todas las sesiones del proceso
+if "POOL" not in globals():
+    POOL = DocumentPool()
+
+class PooledDocument:
+    """
+    Documento PDF de una sesión, respaldado por POOL.
+
+    Expone los datos de solo lectura que usa la app (name, page_count,
+    get_toc). Para trabajar con páginas se usa lease(), que entrega un
+    fitz.Document exclusivo del hilo mientras dura el bloque. close() suelta
+    la referencia de la sesión (también al recolectarse el objeto).
+    """
+    def __init__(self, path, pool=None):
+        self.name = os.path.abspath(path)
+        self._pool = pool or POOL
+        self._pool.retain(self.name)
+        self._finalizer = weakref.finalize(self, self._pool.release_file, self.name)
+        with self.lease() as handle:
+            self.page_count = handle.page_count
+
+    def __len__(self):
+        return self.page_count
+
+    @property
+    def is_closed(self):
+        return not self._finalizer.alive
+
+    def lease(self):
+        if self.is_closed:
+            raise ValueError(f"Documento cerrado: {self.name}")
+        return self._pool.lease(self.name)
+
+    def get_toc(self):
+        with self.lease() as handle:
+            return handle.get_toc()
+
+    def close(self):
+        self._finalizer() # Idempotente
+
+def open_document(path, pool=None):
+    """
+    Abre un PDF para una sesión a través del pool.
+
+    Returns:
+        PooledDocument: Documento (los handles reales se comparten entre sesiones).
+    """
+    return PooledDocument(path, pool)
+
+@contextmanager
+def lease(doc):
+    """
+    fitz.Document utilizable por el hilo actual durante el bloque.
+
+    Documentos del pool (PooledDocument, LazyDocument): handle exclusivo
+    del pool. fitz.Document sueltos (scripts, benchmark): el propio
+    documento bajo page_store.document_lock.
+    """
+    if hasattr(doc, "lease"):
+        with doc.lease() as handle:
+            yield handle
+    else:
+        with page_store.document_lock(doc):
+            yield doc
@@ -2,8 +2,25 @@ import cv2
 import numpy as np
 import re
 import io
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 
+# Estimación de orientación: lado mayor del análisis y |log(filas/columnas)|
+# mínimo para confiar en el resultado. Texto horizontal da ~+1.0, texto
+# rotado ~-1.0; un diagrama casi sin texto queda cerca de 0.
+ORIENTATION_MAX_SIDE = 800
+ORIENTATION_MIN_CONFIDENCE = 0.4
+
+# Hash perceptual: ancho al que se reduce la imagen antes de binarizarla
+PHASH_ANALYSIS_WIDTH = 512
+
+# Rasgos de contenido (ORB) para confirmar que dos fotos son el mismo
+# problema: puntos por imagen y coincidencias geométricamente consistentes
+# mínimas. Tomas del mismo problema dan >= ~35; páginas distintas (incluso
+# texto con la misma maquetación, que el pHash no separa) <= ~10.
+CONTENT_FEATURES = 200
+CONTENT_MIN_MATCHES = 20
+
 def detect_blur(image_bytes, threshold=100.0):
     """
     Detecta si una imagen está borrosa usando la varianza del Laplaciano.
@@ -19,7 +36,7 @@ def detect_blur(image_bytes, threshold=100.0):
             return False, 0.0
 
         # Calcular varianza del Laplaciano
-        score = cv2.Laplacian(img, cv2.CV_64F).var()
+        score = laplacian_variance(img)
         is_blurry = score < threshold
         
         return is_blurry, score
@@ -27,6 +44,69 @@ def detect_blur(image_bytes, threshold=100.0):
         print(f"Error en detect_blur: {e}")
         return False, 999.0
 
+def laplacian_variance(gray):
+    """
+    Varianza del Laplaciano de una imagen en gris (score de blur).
+
+    El Laplaciano de una imagen uint8 cabe en int16 (|valor| <= 1020), así que
+    se calcula en CV_16S y se reduce con meanStdDev: resultado idéntico al de
+    Laplacian(CV_64F).var() con ~5x menos CPU y 1/4 de la memoria.
+
+    Args:
+        gray (np.ndarray): Imagen en gris (uint8).
+
+    Returns:
+        float: Varianza del Laplaciano.
+    """
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    return float(std[0][0]) ** 2
+
+def blur_score(image):
+    """
+    Score de blur de una imagen (bytes o ruta), igual al de detect_blur.
+
+    Returns:
+        float: Varianza del Laplaciano. None si no se pudo decodificar.
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+
+    gray = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    return laplacian_variance(gray)
+
+def detect_blur_batch(images, threshold=100.0, workers=None):
+    """
+    Detecta blur en muchas imágenes (ej: una carpeta de entregas).
+
+    Args:
+        images (iterable): Bytes de imágenes o rutas a archivos.
+        threshold (float): Mismo umbral que detect_blur.
+        workers (int, optional): Hilos para leer/decodificar en paralelo
+                                 (OpenCV libera el GIL). None = secuencial.
+
+    Returns:
+        list: Tuplas (is_blurry, score) en el mismo orden de entrada.
+              (False, 0.0) si una imagen no se pudo decodificar, igual que detect_blur.
+    """
+    def score_one(image):
+        try:
+            score = blur_score(image)
+        except Exception as e:
+            print(f"Error en detect_blur_batch: {e}")
+            return False, 999.0
+        if score is None:
+            return False, 0.0
+        return score < threshold, score
+
+    images = list(images)
+    if workers and workers > 1 and len(images) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(score_one, images))
+    return [score_one(image) for image in images]
+
 def clean_image(image_bytes):
     """
     Aplica pre-procesamiento avanzado para mejorar OCR:
@@ -46,20 +126,8 @@ def clean_image(image_bytes):
         # 2. Grayscale
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         
-        # 3. CLAHE (Mejora contraste local)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        
-        # 4. Thresholding (Opcional: Binarización suave para resaltar texto)
-        # Usamos Adaptive Gaussian Thresholding que maneja bien iluminación irregular
-        binary = cv2.adaptiveThreshold(
-            enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
-        )
-        
-        # Mezclar un poco con la original mejorada para no perder detalles finos
-        # (A veces el binario puro rompe letras delgadas)
-        final_img = cv2.addWeighted(enhanced, 0.7, binary, 0.3, 0)
+        # 3-4. CLAHE + Thresholding
+        final_img = _enhance_for_ocr(gray)
 
         # 5. Codificar de vuelta a bytes
         is_success, buffer = cv2.imencode(".png", final_img)
@@ -72,6 +140,208 @@ def clean_image(image_bytes):
         print(f"Error en clean_image: {e}")
         return image_bytes
 
+def _enhance_for_ocr(gray):
+    """CLAHE + binarización adaptativa suave sobre una imagen en gris."""
+    # CLAHE (Mejora contraste local)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    enhanced = clahe.apply(gray)
+    
+    # Thresholding (Opcional: Binarización suave para resaltar texto)
+    # Usamos Adaptive Gaussian Thresholding que maneja bien iluminación irregular
+    binary = cv2.adaptiveThreshold(
+        enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+        cv2.THRESH_BINARY, 11, 2
+    )
+    
+    # Mezclar un poco con la original mejorada para no perder detalles finos
+    # (A veces el binario puro rompe letras delgadas)
+    return cv2.addWeighted(enhanced, 0.7, binary, 0.3, 0)
+
+def estimate_orientation(gray, max_side=ORIENTATION_MAX_SIDE):
+    """
+    Estima si el texto de una foto está horizontal o girado 90°, sin red.
+
+    Usa perfiles de proyección: en texto horizontal los espacios entre
+    renglones dejan muchas filas sin tinta y casi ninguna columna vacía; con
+    la página girada pasa lo contrario. El sentido del giro (±90°) no se
+    puede distinguir así.
+
+    Args:
+        gray (np.ndarray): Imagen en escala de grises.
+        max_side (int): Se reduce a este lado mayor antes de analizar.
+
+    Returns:
+        tuple: (orientacion, confianza) con orientacion 'horizontal',
+               'vertical' o None si la confianza es menor que
+               ORIENTATION_MIN_CONFIDENCE.
+    """
+    if gray is None or gray.size == 0:
+        return None, 0.0
+
+    height, width = gray.shape[:2]
+    factor = max_side / max(height, width)
+    if factor < 1:
+        gray = cv2.resize(gray, (max(1, int(width * factor)), max(1, int(height * factor))),
+                          interpolation=cv2.INTER_AREA)
+
+    # Tinta = 1 (Otsu invertido), recortada a su bounding box para que los
+    # márgenes no cuenten como filas/columnas vacías
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ys, xs = np.nonzero(ink)
+    if len(ys) == 0:
+        return None, 0.0
+    ink = ink[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+    def empty_fraction(profile):
+        return np.mean(profile < 0.05 * profile.max()) + 1e-3
+
+    ratio = np.log(empty_fraction(ink.mean(axis=1)) / empty_fraction(ink.mean(axis=0)))
+    confidence = float(abs(ratio))
+    if confidence < ORIENTATION_MIN_CONFIDENCE:
+        return None, confidence
+    return ("horizontal" if ratio > 0 else "vertical"), confidence
+
+def perceptual_hash(gray):
+    """
+    Hash perceptual (pHash) de la tinta de una foto, como entero de 64 bits.
+
+    Se calcula sobre la máscara de tinta (umbral adaptativo) y no sobre el
+    gris: sombras y degradados de iluminación cambian el brillo del fondo
+    pero no la tinta, y con el gris directo dos tomas del mismo problema
+    quedaban más lejos que dos problemas distintos. Luego se toman las
+    frecuencias bajas de la DCT (8x8) y cada bit indica si el coeficiente
+    supera la mediana. Tomas del mismo problema quedan a <= ~10 bits.
+    """
+    height, width = gray.shape[:2]
+    if width > PHASH_ANALYSIS_WIDTH:
+        new_height = max(1, int(height * PHASH_ANALYSIS_WIDTH / width))
+        gray = cv2.resize(gray, (PHASH_ANALYSIS_WIDTH, new_height), interpolation=cv2.INTER_AREA)
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY_INV, 31, 15)
+    small = cv2.resize(ink.astype(np.float32), (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:]) # Sin el término DC en la mediana
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def content_features(gray, max_features=CONTENT_FEATURES):
+    """
+    Puntos ORB de la foto (a PHASH_ANALYSIS_WIDTH de ancho): posición y
+    descriptor binario de cada uno. Invariantes a giro y desplazamiento,
+    pero propios del contenido (trazos, letras), a diferencia del pHash.
+
+    Returns:
+        tuple: (points float32 Nx2, descriptors uint8 Nx32). N puede ser 0.
+    """
+    height, width = gray.shape[:2]
+    if width > PHASH_ANALYSIS_WIDTH:
+        new_height = max(1, int(height * PHASH_ANALYSIS_WIDTH / width))
+        gray = cv2.resize(gray, (PHASH_ANALYSIS_WIDTH, new_height), interpolation=cv2.INTER_AREA)
+    keypoints, descriptors = cv2.ORB_create(nfeatures=max_features).detectAndCompute(gray, None)
+    if descriptors is None:
+        return np.empty((0, 2), np.float32), np.empty((0, 32), np.uint8)
+    return np.float32([k.pt for k in keypoints]), descriptors
+
+def matching_features(features_a, features_b):
+    """
+    Coincidencias entre dos conjuntos de content_features que respetan una
+    misma transformación (giro + escala + desplazamiento, RANSAC).
+    Letras iguales en páginas distintas coinciden sueltas, pero no en bloque.
+
+    Returns:
+        int: Cantidad de coincidencias consistentes.
+    """
+    (points_a, descriptors_a), (points_b, descriptors_b) = features_a, features_b
+    if len(descriptors_a) < 3 or len(descriptors_b) < 3:
+        return 0
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors_a, descriptors_b)
+    if len(matches) < 3:
+        return 0
+    source = points_a[[m.queryIdx for m in matches]]
+    target = points_b[[m.trainIdx for m in matches]]
+    _, inliers = cv2.estimateAffinePartial2D(source, target, method=cv2.RANSAC, ransacReprojThreshold=4)
+    return int(inliers.sum()) if inliers is not None else 0
+
+class ScanImage:
+    """
+    Foto de un ejercicio decodificada una sola vez.
+
+    Detección de blur, limpieza y extracción de firma comparten el mismo
+    buffer NumPy en gris; solo se codifica (PNG) si alguien pide bytes.
+    Toda la cadena solo usa escala de grises, así que se decodifica
+    directamente en gris (mismo score que detect_blur).
+    """
+    def __init__(self, image_bytes):
+        self.source_bytes = image_bytes
+        self.gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        self._cleaned = None
+        self._orientation = None
+        self._phash = None
+        self._features = None
+
+    @property
+    def ok(self):
+        """False si la imagen no se pudo decodificar."""
+        return self.gray is not None
+
+    def blur(self, threshold=100.0):
+        """Igual que detect_blur, sin volver a decodificar."""
+        if not self.ok:
+            return False, 0.0
+        score = laplacian_variance(self.gray)
+        return score < threshold, score
+
+    def orientation(self):
+        """estimate_orientation sobre el buffer en gris (se calcula una vez)."""
+        if self._orientation is None:
+            self._orientation = estimate_orientation(self.gray) if self.ok else (None, 0.0)
+        return self._orientation
+
+    def perceptual_hash(self):
+        """
+        perceptual_hash del buffer en gris (clave de signature_cache).
+        No usa cleaned(): el realce CLAHE amplifica el ruido del fondo y
+        separa tomas del mismo problema; la máscara de tinta ya limpia.
+        """
+        if self._phash is None and self.ok:
+            self._phash = perceptual_hash(self.gray)
+        return self._phash
+
+    def content_features(self):
+        """content_features del buffer en gris (confirman los aciertos de signature_cache)."""
+        if self._features is None and self.ok:
+            self._features = content_features(self.gray)
+        return self._features
+
+    def cleaned(self):
+        """Imagen pre-procesada para OCR (ndarray en gris, se calcula una vez)."""
+        if self._cleaned is None and self.ok:
+            try:
+                self._cleaned = _enhance_for_ocr(self.gray)
+            except Exception as e:
+                print(f"Error en clean_image: {e}")
+                self._cleaned = self.gray
+        return self._cleaned
+
+    def to_pil(self, cleaned=True):
+        """
+        Vista PIL del buffer (sin copiar), para entregar al modelo.
+        Si la imagen no se pudo decodificar, se abre el archivo original.
+        """
+        array = self.cleaned() if cleaned else self.gray
+        if array is None:
+            return Image.open(io.BytesIO(self.source_bytes))
+        array = np.ascontiguousarray(array)
+        height, width = array.shape
+        return Image.frombuffer("L", (width, height), array, "raw", "L", 0, 1)
+
+    def to_png_bytes(self, cleaned=True):
+        """Codifica a PNG (solo cuando hace falta enviar bytes)."""
+        array = self.cleaned() if cleaned else self.gray
+        if array is None:
+            return self.source_bytes
+        is_success, buffer = cv2.imencode(".png", array)
+        return buffer.tobytes() if is_success else self.source_bytes
+
 def sanitize_ocr(ocr_list):
     """
     Limpia y normaliza la lista de valores extraídos por la IA.
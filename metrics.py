@@ -0,0 +1,162 @@
+import os
+import json
+import math
+import time
+import atexit
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+import page_store
+
+# Exportación opcional de eventos como JSONL (una línea por operación):
+# CIRCUIT_VERIFIER_METRICS_EXPORT=1 (a .cache/metrics.jsonl) o una ruta en
+# CIRCUIT_VERIFIER_METRICS_FILE. Por defecto las métricas solo quedan en RAM.
+METRICS_FILE = os.environ.get("CIRCUIT_VERIFIER_METRICS_FILE") or (
+    os.path.join(page_store.CACHE_DIR, "metrics.jsonl")
+    if os.environ.get("CIRCUIT_VERIFIER_METRICS_EXPORT", "0") == "1" else ""
+)
+METRICS_ENABLED = os.environ.get("CIRCUIT_VERIFIER_METRICS", "1") != "0"
+
+# Los eventos se escriben en bloques de METRICS_FLUSH_EVENTS (y al salir).
+# Al superar METRICS_MAX_BYTES el archivo se rota a <archivo>.1 (se pisa el anterior).
+METRICS_FLUSH_EVENTS = 200
+METRICS_MAX_BYTES = int(os.environ.get("CIRCUIT_VERIFIER_METRICS_MAX_MB", "10")) * 1024 * 1024
+
+# Eventos recientes en RAM (panel de depuración)
+RECENT_EVENTS = 200
+
+class MetricsRecorder:
+    """
+    Registro de operaciones como eventos estructurados.
+
+    Cada evento tiene nombre, duración (ms), momento y campos libres
+    (pages, bytes, hit, format...). Se agregan por nombre (conteo, total,
+    p95), se guardan los últimos en RAM y, si hay archivo configurado, se
+    acumulan y se agregan al JSONL por bloques (flush).
+    Los contadores (incr) sirven para hits/misses sin duración.
+    Thread-safe: se alimenta también desde hilos de prefetch y de red.
+    """
+    def __init__(self, path=METRICS_FILE, enabled=METRICS_ENABLED, recent=RECENT_EVENTS):
+        self.path = path or None
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # Solo escritura a disco (fuera de _lock)
+        self._pending = []
+        self._recent = deque(maxlen=recent)
+        self._durations = defaultdict(list)
+        self._counters = defaultdict(int)
+
+    def record(self, name, duration_ms=None, **fields):
+        """Registra un evento ya medido."""
+        if not self.enabled:
+            return
+        event = {"event": name, "ts": round(time.time(), 3)}
+        if duration_ms is not None:
+            event["ms"] = round(duration_ms, 3)
+        event.update(fields)
+        with self._lock:
+            self._recent.append(event)
+            if duration_ms is not None:
+                durations = self._durations[name]
+                durations.append(duration_ms)
+                if len(durations) > 1000:
+                    del durations[:500] # Solo para percentiles recientes
+            self._counters[name] += 1
+            if self.path:
+                self._pending.append(event)
+                should_flush = len(self._pending) >= METRICS_FLUSH_EVENTS
+            else:
+                should_flush = False
+        if should_flush:
+            self.flush()
+
+    @contextmanager
+    def timed(self, name, **fields):
+        """
+        Mide el bloque y registra el evento al salir.
+        El dict entregado permite agregar campos conocidos al final
+        (ej: fields["pages"] = n). Si el bloque falla se registra error.
+        """
+        start = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000, **fields)
+
+    def incr(self, name, amount=1):
+        """Suma a un contador (sin evento en el archivo)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] += amount
+
+    def summary(self):
+        """
+        Agregado por nombre de evento / contador.
+
+        Returns:
+            list: Dicts {event, count, total_ms, mean_ms, p95_ms} ordenados
+                  por tiempo total (mayor primero).
+        """
+        with self._lock:
+            rows = []
+            for name, count in self._counters.items():
+                durations = sorted(self._durations.get(name, []))
+                row = {"event": name, "count": count}
+                if durations:
+                    row["total_ms"] = round(sum(durations), 1)
+                    row["mean_ms"] = round(sum(durations) / len(durations), 2)
+                    row["p95_ms"] = round(durations[max(0, math.ceil(0.95 * len(durations)) - 1)], 2)
+                rows.append(row)
+        return sorted(rows, key=lambda r: r.get("total_ms", 0), reverse=True)
+
+    def recent(self, limit=50):
+        """Últimos eventos (más reciente primero)."""
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._durations.clear()
+            self._counters.clear()
+
+    def flush(self):
+        """Escribe los eventos pendientes en el archivo (rotándolo si supera el tope)."""
+        with self._write_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            path = self.path
+            if not events or not path:
+                return
+            lines = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                if os.path.exists(path) and os.path.getsize(path) + len(lines) > METRICS_MAX_BYTES:
+                    os.replace(path, path + ".1")
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                print(f"Advertencia: No se pudo escribir métricas en {path}: {e}")
+                self.path = None # No reintentar en cada bloque
+
+# Registro compartido (se preserva si app.py hace importlib.reload)
+if "METRICS" not in globals():
+    METRICS = MetricsRecorder()
+    atexit.register(METRICS.flush)
+
+def timed(name, **fields):
+    """Atajo de METRICS.timed (context manager)."""
+    return METRICS.timed(name, **fields)
+
+def record(name, duration_ms=None, **fields):
+    """Atajo de METRICS.record."""
+    METRICS.record(name, duration_ms, **fields)
+
+def incr(name, amount=1):
+    """Atajo de METRICS.incr."""
+    METRICS.incr(name, amount)
@@ -0,0 +1,394 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import weakref
+import threading
+from concurrent.futures import Future
+
+from PIL import Image
+
+import metrics
+
+# Backend del modelo: "gemini" (API real) o "fake" (local, sin red ni costo)
+MODEL_BACKEND = os.environ.get("CIRCUIT_VERIFIER_MODEL_BACKEND", "gemini")
+
+# Límites compartidos por todas las sesiones del proceso
+MODEL_RATE_PER_MINUTE = float(os.environ.get("CIRCUIT_VERIFIER_MODEL_RPM", 60))
+MODEL_BURST = int(os.environ.get("CIRCUIT_VERIFIER_MODEL_BURST", 10))
+MODEL_MAX_CONCURRENCY = int(os.environ.get("CIRCUIT_VERIFIER_MODEL_CONCURRENCY", 4))
+
+# Reintentos ante 429 / errores transitorios (backoff exponencial con jitter)
+MODEL_MAX_RETRIES = int(os.environ.get("CIRCUIT_VERIFIER_MODEL_RETRIES", 4))
+MODEL_BACKOFF_BASE = 1.0 # segundos
+MODEL_BACKOFF_MAX = 30.0
+
+class ModelError(Exception):
+    """El modelo no respondió (límite de uso, servicio caído...) tras los reintentos."""
+
+class FakeRateLimitError(Exception):
+    """429 simulado por FakeBackend."""
+
+def is_retryable(error):
+    """True si el error es transitorio (429, 5xx, timeout) y vale la pena reintentar."""
+    if isinstance(error, FakeRateLimitError):
+        return True
+    # Sin importar google.api_core: si no está cargado, el error no puede ser suyo
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is not None and isinstance(error, (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError)):
+        return True
+    return "429" in str(error)
+
+class TokenBucket:
+    """
+    Limitador de tasa: `rate` solicitudes por segundo con ráfagas de hasta
+    `capacity`. acquire() bloquea hasta que haya un token disponible.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Toma un token. Retorna los segundos que tuvo que esperar."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+def request_key(model_name, system_instruction, parts):
+    """Hash de una solicitud (modelo + instrucción + partes) para deduplicar."""
+    sha = hashlib.sha256()
+    sha.update(f"{model_name}\x00{system_instruction or ''}\x00".encode("utf-8"))
+    for part in parts:
+        if isinstance(part, Image.Image):
+            sha.update(f"img:{part.mode}:{part.size}".encode("utf-8"))
+            sha.update(part.tobytes())
+        elif isinstance(part, bytes):
+            sha.update(b"bytes:" + part)
+        else:
+            sha.update(f"str:{part}".encode("utf-8"))
+        sha.update(b"\x00")
+    return sha.hexdigest()
+
+# API key de Gemini (ver configure_gemini). Se preserva entre reloads.
+if "_GEMINI_API_KEY" not in globals():
+    _GEMINI_API_KEY = None
+
+def configure_gemini(api_key):
+    """
+    Registra la API key. google.generativeai (~1s de import) no se carga
+    aquí sino en la primera llamada real al modelo.
+    """
+    global _GEMINI_API_KEY
+    _GEMINI_API_KEY = api_key
+
+class GeminiBackend:
+    """Modelos reales de google.generativeai (importado en el primer uso)."""
+    name = "gemini"
+
+    def __init__(self):
+        self._configured_key = None
+        self._lock = threading.Lock()
+
+    def model(self, model_name, system_instruction=None):
+        import google.generativeai as genai
+        with self._lock:
+            if _GEMINI_API_KEY and self._configured_key != _GEMINI_API_KEY:
+                genai.configure(api_key=_GEMINI_API_KEY)
+                self._configured_key = _GEMINI_API_KEY
+        return genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
+
+class FakeResponse:
+    """Respuesta con la misma forma que GenerateContentResponse (.text e iterable de chunks)."""
+    def __init__(self, text, chunk_size=12, chunk_delay=0.0):
+        self.text = text
+        self._chunk_size = chunk_size
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for start in range(0, len(self.text), self._chunk_size):
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            yield FakeResponse(self.text[start:start + self._chunk_size])
+
+class FakeBackend:
+    """
+    Servidor simulado en proceso, para medir latencia y rendimiento sin red.
+
+    Cada llamada tarda `latency` ± `jitter` segundos. Con más de
+    `server_concurrency` llamadas simultáneas, o con probabilidad
+    `error_rate`, responde 429 (FakeRateLimitError) como la API real.
+    """
+    name = "fake"
+
+    def __init__(self, latency=0.3, jitter=0.1, error_rate=0.0, server_concurrency=8,
+                 signature_reply="10V, 4.7k, 2mH", chat_reply="Respuesta simulada del auditor."):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_concurrency = server_concurrency
+        self.signature_reply = signature_reply
+        self.chat_reply = chat_reply
+        self.calls = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def model(self, model_name, system_instruction=None):
+        return FakeModel(self)
+
+    def respond(self, text, stream=False):
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            overloaded = self._in_flight > self.server_concurrency
+        try:
+            if overloaded or random.random() < self.error_rate:
+                raise FakeRateLimitError("429 Resource has been exhausted (simulado)")
+            delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+            if stream:
+                # El primer chunk llega antes: el resto se reparte al iterar
+                time.sleep(delay / 4)
+                return FakeResponse(text, chunk_delay=delay / 8)
+            time.sleep(delay)
+            return FakeResponse(text)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+class FakeModel:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, parts, stream=False):
+        return self._backend.respond(self._backend.signature_reply, stream)
+
+    def start_chat(self, history=None):
+        return FakeChat(self._backend)
+
+class FakeChat:
+    def __init__(self, backend):
+        self._backend = backend
+        self.history = []
+
+    def send_message(self, content, stream=False):
+        response = self._backend.respond(self._backend.chat_reply, stream)
+        self.history.append(content)
+        return response
+
+class StreamingResponse:
+    """
+    Respuesta en streaming (stream=True) que conserva su cupo de concurrencia
+    hasta terminar de leerse: los chunks siguen llegando del servicio mientras
+    se itera. El cupo se devuelve al agotar el stream, al fallar, con close()
+    o si la respuesta se descarta sin leer. El resto de atributos (.text...)
+    son los de la respuesta original.
+    """
+    def __init__(self, response, release):
+        self._response = response
+        self._release = weakref.finalize(self, release) # Idempotente
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        finally:
+            self._release()
+
+    def close(self):
+        self._release()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+class ModelClient:
+    """
+    Capa compartida para todas las llamadas al modelo.
+
+    - Token bucket (MODEL_RATE_PER_MINUTE, ráfagas de MODEL_BURST).
+    - Concurrencia acotada (MODEL_MAX_CONCURRENCY llamadas en vuelo; un
+      stream ocupa su cupo hasta que se termina de leer).
+    - Reintentos con backoff exponencial y jitter ante 429 / 5xx.
+    - Single-flight: solicitudes idénticas simultáneas (generate) comparten
+      una sola llamada.
+    Si se agotan los reintentos se lanza ModelError, para que quien llama
+    pueda distinguir "el servicio falló" de "no se detectaron valores".
+    """
+    def __init__(self, backend, rate_per_minute=MODEL_RATE_PER_MINUTE, burst=MODEL_BURST,
+                 max_concurrency=MODEL_MAX_CONCURRENCY, max_retries=MODEL_MAX_RETRIES,
+                 backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX):
+        self.backend = backend
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "deduplicated": 0,
+                       "throttled_seconds": 0.0}
+
+    def model(self, model_name, system_instruction=None):
+        """Modelo del backend configurado (real o simulado)."""
+        return self.backend.model(model_name, system_instruction)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Ejecuta fn(*args, **kwargs) respetando tasa, concurrencia y reintentos.
+        Con stream=True retorna un StreamingResponse.
+
+        Raises:
+            ModelError: Error transitorio que persiste tras los reintentos.
+        """
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            self._slots.acquire()
+            holding_slot = True
+            try:
+                with self._lock:
+                    self._stats["calls"] += 1
+                    self._stats["throttled_seconds"] += waited
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                    metrics.record("model_call", (time.perf_counter() - start) * 1000,
+                                   backend=self.backend.name, attempt=attempt,
+                                   throttled_ms=round(waited * 1000, 1))
+                    if kwargs.get("stream"):
+                        # El cupo lo devuelve el stream cuando se termina de leer
+                        holding_slot = False
+                        return StreamingResponse(result, self._slots.release)
+                    return result
+                except Exception as e:
+                    metrics.record("model_call", (time.perf_counter() - start) * 1000,
+                                   backend=self.backend.name, attempt=attempt,
+                                   error=type(e).__name__)
+                    if not is_retryable(e):
+                        raise
+                    if attempt >= self.max_retries:
+                        with self._lock:
+                            self._stats["failures"] += 1
+                        raise ModelError(f"El modelo no respondió tras {attempt + 1} intentos: {e}") from e
+                    error = e
+            finally:
+                if holding_slot:
+                    self._slots.release()
+            # Esperar fuera del semáforo para no bloquear otras llamadas
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.0)
+            print(f"Advertencia: Modelo saturado ({error}). Reintento en {delay:.1f}s...")
+            with self._lock:
+                self._stats["retries"] += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def generate(self, model, parts, model_name="", system_instruction=None, **kwargs):
+        """
+        model.generate_content(parts) con deduplicación de solicitudes en vuelo.
+
+        Args:
+            model: Modelo obtenido con self.model().
+            parts (list): Partes del contenido (texto / PIL.Image / bytes).
+            model_name, system_instruction: Identifican la solicitud al deduplicar.
+        """
+        key = request_key(model_name, system_instruction, parts)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._stats["deduplicated"] += 1
+                metrics.incr("model_call.deduplicated")
+
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(self.call(model.generate_content, parts, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return future.result()
+
+    def stats(self):
+        """Contadores de uso del cliente."""
+        with self._lock:
+            return dict(self._stats, backend=self.backend.name)
+
+def _default_backend():
+    if MODEL_BACKEND == "fake":
+        return FakeBackend()
+    return GeminiBackend()
+
+# Cliente compartido (se preserva si app.py hace importlib.reload)
+if "_CLIENT" not in globals():
+    _CLIENT = None
+    _CLIENT_LOCK = threading.Lock()
+
+def get_client():
+    """Cliente compartido del proceso (se crea la primera vez)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = ModelClient(_default_backend())
+        return _CLIENT
+
+def set_client(client):
+    """Reemplaza el cliente compartido (ej: ModelClient(FakeBackend(...)) para pruebas)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = client
+
+if __name__ == "__main__":
+    # Prueba de carga local contra el backend simulado
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Carga simulada contra FakeBackend.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    client = ModelClient(FakeBackend(latency=args.latency, error_rate=args.error_rate),
+                         rate_per_minute=6000, burst=20, backoff_base=0.1)
+    model = client.model("fake")
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            client.generate(model, [f"solicitud {i}"])
+        except ModelError as e:
+            print(f"Error: {e}")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{args.requests} solicitudes en {elapsed:.2f}s ({args.requests / elapsed:.1f}/s)")
+    print(f"Latencia p50={latencies[len(latencies) // 2]:.3f}s p95={latencies[int(len(latencies) * 0.95) - 1]:.3f}s")
+    print(client.stats())
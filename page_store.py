@@ -0,0 +1,279 @@
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import parallel_scan
+import text_utils
+
+# Directorio de caché persistente (sobrevive a reinicios del proceso)
+CACHE_DIR = os.environ.get(
+    "CIRCUIT_VERIFIER_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+PAGE_STORE_DIR = os.path.join(CACHE_DIR, "pages")
+STORE_VERSION = 2 # 2: celdas de Excel completas (converter._format_row)
+
+# Máximo de documentos con texto en RAM (cada libro grande ocupa varios MB)
+MAX_STORES_IN_MEMORY = 4
+
+# Registros a nivel de módulo. Se preservan si app.py hace importlib.reload,
+# ya que reload re-ejecuta el módulo sobre el mismo __dict__.
+if "_STORES" not in globals():
+    _STORES = OrderedDict()
+if "_FILE_HASHES" not in globals():
+    _FILE_HASHES = {}
+if "_BUILD_LOCKS" not in globals():
+    _BUILD_LOCKS = {} # doc_hash -> [lock, hilos que lo usan]
+    _REGISTRY_LOCK = threading.Lock()
+
+def document_lock(doc):
+    """
+    Lock (reentrante) de un objeto documento.
+    fitz.Document no es thread-safe: todo acceso desde hilos distintos
+    (render en segundo plano, extracción de texto) a un documento suelto
+    debe tomar este lock. Los documentos del pool usan document_pool.lease.
+
+    El lock se guarda en el propio objeto (fitz.Document no admite weakref):
+    vive y muere con él.
+    """
+    with _REGISTRY_LOCK:
+        lock = getattr(doc, "_page_store_lock", None)
+        if lock is None:
+            lock = threading.RLock()
+            doc._page_store_lock = lock
+        return lock
+
+@contextmanager
+def _build_lock(doc_hash):
+    """
+    Single-flight por contenido: sesiones con objetos documento distintos del
+    mismo libro esperan a que una sola extraiga el texto. La entrada se borra
+    cuando el último hilo la suelta.
+    """
+    with _REGISTRY_LOCK:
+        entry = _BUILD_LOCKS.setdefault(doc_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _REGISTRY_LOCK:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _BUILD_LOCKS[doc_hash]
+
+def file_hash(filepath):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo.
+    Se memoriza por (ruta, tamaño, mtime) para no releer libros grandes.
+    """
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    memo_key = (filepath, stat.st_size, stat.st_mtime_ns)
+    if memo_key in _FILE_HASHES:
+        return _FILE_HASHES[memo_key]
+
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _FILE_HASHES[memo_key] = digest
+    return digest
+
+def document_hash(doc):
+    """
+    Identificador por contenido de un documento (no por nombre de archivo).
+
+    Args:
+        doc (fitz.Document): Documento cargado.
+
+    Returns:
+        str: Hash SHA-256 en hexadecimal (o el id del artefacto si el archivo
+             ya está guardado por contenido en artifact_store).
+    """
+    import artifact_store # Import diferido: artifact_store depende de CACHE_DIR
+
+    path = getattr(doc, "name", "")
+    known_id = artifact_store.artifact_id(path)
+    if known_id:
+        return known_id
+    if path and os.path.exists(path):
+        return file_hash(path)
+    # Documento en memoria (sin ruta): hashear los bytes serializados
+    return hashlib.sha256(doc.tobytes()).hexdigest()
+
+class PageStore:
+    """
+    Texto de todas las páginas de un documento, crudo y normalizado.
+    Se construye una sola vez por documento y se reutiliza en búsquedas,
+    índice de capítulos y extracción de componentes.
+    """
+    def __init__(self, doc_hash, raw_pages, normalized_pages=None):
+        self.doc_hash = doc_hash
+        self.raw = raw_pages
+        if normalized_pages is None:
+            normalized_pages = [text_utils.normalize_text(t) for t in raw_pages]
+        self.normalized = normalized_pages
+
+    @property
+    def page_count(self):
+        return len(self.raw)
+
+    def save(self, directory=PAGE_STORE_DIR):
+        """Persiste el texto en disco (JSON comprimido)."""
+        os.makedirs(directory, exist_ok=True)
+        path = _store_path(self.doc_hash, directory)
+        payload = {
+            "version": STORE_VERSION,
+            "raw": self.raw,
+            "normalized": self.normalized,
+        }
+        # Temporal propio: dos sesiones que guardan el mismo libro no se pisan
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, path) # Escritura atómica
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, doc_hash, directory=PAGE_STORE_DIR):
+        """Carga el texto desde disco. Retorna None si no existe o es inválido."""
+        path = _store_path(doc_hash, directory)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != STORE_VERSION:
+                return None
+            return cls(doc_hash, payload["raw"], payload["normalized"])
+        except Exception as e:
+            print(f"Advertencia: Caché de texto corrupta ({path}): {e}")
+            return None
+
+def _store_path(doc_hash, directory):
+    return os.path.join(directory, f"{doc_hash}.json.gz")
+
+def _extract_raw_pages(doc, workers=None):
+    """Extrae el texto crudo de todas las páginas (en paralelo si compensa)."""
+    import metrics # Import diferido: metrics depende de CACHE_DIR
+    import document_pool # Import diferido: document_pool depende de page_store
+
+    with metrics.timed("text_extraction", pages=doc.page_count, source="pdf"):
+        with document_pool.lease(doc) as handle:
+            scanned = parallel_scan.scan_pages(handle, parallel_scan.extract_text, workers=workers)
+    return [text or "" for _, text in scanned]
+
+def _lookup(doc_hash):
+    with _REGISTRY_LOCK:
+        store = _STORES.get(doc_hash)
+        if store is not None:
+            _STORES.move_to_end(doc_hash)
+        return store
+
+def _remember(store):
+    with _REGISTRY_LOCK:
+        _STORES[store.doc_hash] = store
+        _STORES.move_to_end(store.doc_hash)
+        while len(_STORES) > MAX_STORES_IN_MEMORY:
+            _STORES.popitem(last=False)
+
+def get_page_store(doc, workers=None):
+    """
+    Obtiene el texto de todas las páginas del documento.
+
+    Orden de búsqueda: RAM -> disco -> extracción completa (y persistencia).
+
+    Args:
+        doc (fitz.Document): Documento cargado.
+        workers (int, optional): Procesos para la extracción inicial
+                                 (ver parallel_scan.scan_pages).
+
+    Returns:
+        PageStore: Texto crudo y normalizado por página.
+    """
+    doc_hash = document_hash(doc)
+    store = _lookup(doc_hash)
+    if store is not None:
+        return store
+
+    with _build_lock(doc_hash):
+        # Otro hilo pudo construirlo mientras esperábamos el lock
+        store = _lookup(doc_hash)
+        if store is not None:
+            return store
+
+        store = PageStore.load(doc_hash)
+        if store is None:
+            print(f"Info: Extrayendo texto de {doc.page_count} páginas (primera vez)...")
+            store = PageStore(doc_hash, _extract_raw_pages(doc, workers))
+            try:
+                store.save()
+            except Exception as e:
+                print(f"Advertencia: No se pudo persistir la caché de texto: {e}")
+
+        _remember(store)
+    return store
+
+def get_cached_page_store(doc):
+    """
+    Texto del documento solo si ya fue extraído (RAM o disco); no extrae nada.
+    Retorna None si el documento aún no tiene caché de texto.
+    """
+    doc_hash = document_hash(doc)
+    store = _lookup(doc_hash)
+    if store is None:
+        store = PageStore.load(doc_hash)
+        if store is not None:
+            _remember(store)
+    return store
+
+def save_page_texts(doc, raw_pages):
+    """
+    Registra y persiste texto ya extraído por otra vía (ej: directamente de un
+    docx/xlsx), sin leer el documento con PyMuPDF.
+
+    Returns:
+        PageStore: El store registrado para el documento.
+    """
+    store = PageStore(document_hash(doc), raw_pages)
+    try:
+        store.save()
+    except Exception as e:
+        print(f"Advertencia: No se pudo persistir la caché de texto: {e}")
+    _remember(store)
+    return store
+
+def get_page_text(doc, page_number, normalized=False):
+    """
+    Texto de una página (crudo por defecto).
+
+    Si el documento ya tiene caché de texto se lee de ahí; si no, se extrae
+    solo esa página. Ver una página no dispara la extracción del libro
+    completo (eso queda para la búsqueda y el inventario).
+    """
+    store = get_cached_page_store(doc)
+    if store is not None:
+        if page_number < 0 or page_number >= store.page_count:
+            return ""
+        return store.normalized[page_number] if normalized else store.raw[page_number]
+
+    import document_pool # Import diferido: document_pool depende de page_store
+
+    if page_number < 0 or page_number >= doc.page_count:
+        return ""
+    with document_pool.lease(doc) as handle:
+        text = parallel_scan.extract_text(handle.load_page(page_number)) or ""
+    if normalized:
+        return text_utils.normalize_text(text)
+    return text
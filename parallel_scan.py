@@ -0,0 +1,98 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+# Workers por defecto (configurable con la variable de entorno)
+DEFAULT_WORKERS = int(os.environ.get("CIRCUIT_VERIFIER_WORKERS", os.cpu_count() or 1))
+
+# Por debajo de este número de páginas se escanea en serie: arrancar el pool
+# (un proceso por worker que importa PyMuPDF) cuesta más que el propio escaneo.
+PARALLEL_MIN_PAGES = int(os.environ.get("CIRCUIT_VERIFIER_PARALLEL_MIN_PAGES", 200))
+
+def extract_text(page):
+    """Texto crudo de una página (función de página por defecto)."""
+    return page.get_text("text")
+
+def _scan_shard(filepath, page_fn, start_page, end_page):
+    """
+    Procesa un bloque contiguo de páginas en un proceso worker.
+    Cada worker abre su propio handle de fitz sobre el mismo archivo.
+    """
+    results = []
+    doc = fitz.open(filepath)
+    try:
+        for page_num in range(start_page, end_page):
+            try:
+                results.append((page_num, page_fn(doc.load_page(page_num))))
+            except Exception as e:
+                print(f"Error procesando página {page_num}: {e}")
+                results.append((page_num, None))
+    finally:
+        doc.close()
+    return results
+
+def _shards(start_page, end_page, workers):
+    """Divide [start, end) en bloques contiguos de tamaño similar."""
+    total = end_page - start_page
+    size, extra = divmod(total, workers)
+    shards = []
+    current = start_page
+    for i in range(workers):
+        shard_end = current + size + (1 if i < extra else 0)
+        if shard_end > current:
+            shards.append((current, shard_end))
+        current = shard_end
+    return shards
+
+def scan_pages(doc, page_fn=extract_text, page_range=None, workers=None,
+               min_pages=PARALLEL_MIN_PAGES):
+    """
+    Aplica page_fn a cada página del rango, en paralelo si compensa.
+
+    Args:
+        doc (fitz.Document): Documento cargado (se usa su ruta para los workers).
+        page_fn (callable): Función de nivel de módulo (picklable) page -> resultado.
+        page_range (tuple, optional): (start_page, end_page) 0-based.
+        workers (int, optional): Procesos a usar. Por defecto DEFAULT_WORKERS.
+        min_pages (int): Umbral de páginas por debajo del cual se escanea en serie.
+
+    Returns:
+        list: Tuplas (page_number, resultado) en orden de página.
+              resultado es None si la página falló.
+    """
+    start_page, end_page = 0, doc.page_count
+    if page_range:
+        start_page = max(0, page_range[0])
+        end_page = min(doc.page_count, page_range[1])
+
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    total = end_page - start_page
+    filepath = getattr(doc, "name", "")
+
+    # Modo serie: pocos workers, pocas páginas o documento sin archivo en disco
+    if workers <= 1 or total < min_pages or not filepath or not os.path.exists(filepath):
+        results = []
+        for page_num in range(start_page, end_page):
+            try:
+                results.append((page_num, page_fn(doc.load_page(page_num))))
+            except Exception as e:
+                print(f"Error procesando página {page_num}: {e}")
+                results.append((page_num, None))
+        return results
+
+    print(f"Info: Escaneo paralelo de {total} páginas con {workers} procesos...")
+    # 'spawn' evita heredar hilos y handles de fitz del proceso padre (Streamlit)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(_scan_shard, filepath, page_fn, shard_start, shard_end)
+            for shard_start, shard_end in _shards(start_page, end_page, workers)
+        ]
+        # Los bloques son contiguos y se envían en orden: concatenar mantiene el orden
+        for future in futures:
+            results.extend(future.result())
+    return results
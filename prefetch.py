@@ -0,0 +1,101 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import backend
+
+# Hilos de render en segundo plano compartidos por todas las sesiones.
+# Cada render toma su propio handle de document_pool: un hilo no bloquea
+# el documento entero mientras renderiza (ver POOL_HANDLES_PER_FILE).
+PREFETCH_MAX_WORKERS = int(os.environ.get("CIRCUIT_VERIFIER_PREFETCH_WORKERS", 2))
+
+# Páginas vecinas (actual ± N) y mejores resultados de búsqueda a precargar
+PREFETCH_RADIUS = 2
+PREFETCH_TOP_K = 3
+
+if "_EXECUTOR" not in globals():
+    _EXECUTOR = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS,
+                                   thread_name_prefix="prefetch")
+
+def prefetch_targets(current_page, page_count, search_results=None,
+                     radius=PREFETCH_RADIUS, top_k=PREFETCH_TOP_K):
+    """
+    Lista ordenada por prioridad de páginas a precargar.
+
+    Args:
+        current_page (int): Página visible (0-indexed), no se incluye.
+        page_count (int): Total de páginas del documento.
+        search_results (list, optional): Tuplas (page_number, score) ordenadas.
+        radius (int): Vecinas a cada lado (primero las más cercanas).
+        top_k (int): Cantidad de resultados de búsqueda a incluir.
+
+    Returns:
+        list: Números de página sin duplicados.
+    """
+    targets = []
+    for distance in range(1, radius + 1):
+        for page_num in (current_page + distance, current_page - distance):
+            if 0 <= page_num < page_count:
+                targets.append(page_num)
+    for page_num, _ in (search_results or [])[:top_k]:
+        targets.append(page_num)
+
+    seen = {current_page}
+    ordered = []
+    for page_num in targets:
+        if page_num not in seen:
+            seen.add(page_num)
+            ordered.append(page_num)
+    return ordered
+
+class PrefetchScheduler:
+    """
+    Precarga páginas en RENDER_CACHE desde hilos en segundo plano.
+
+    Cada sesión tiene su propio scheduler: al agendar un nuevo lote se cancela
+    el anterior (tareas aún en cola se descartan; la que está renderizando
+    termina su página). El pool de hilos es compartido y acotado.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+
+    def schedule(self, doc, pages, zoom=2.0, image_format="png"):
+        """Cancela lo pendiente y agenda el render de `pages` en orden."""
+        with self._lock:
+            self._cancel_locked()
+            generation = self._generation
+            for page_num in pages:
+                if backend.is_page_rendered(doc, page_num, zoom, image_format):
+                    continue
+                future = _EXECUTOR.submit(self._render, generation, doc,
+                                          page_num, zoom, image_format)
+                self._futures.append(future)
+
+    def cancel(self):
+        """Descarta todas las precargas pendientes de esta sesión."""
+        with self._lock:
+            self._cancel_locked()
+
+    def pending(self):
+        """Cantidad de precargas aún no terminadas."""
+        with self._lock:
+            return sum(1 for f in self._futures if not f.done())
+
+    def _cancel_locked(self):
+        self._generation += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    def _render(self, generation, doc, page_num, zoom, image_format):
+        # Cancelado después de empezar a esperar en la cola
+        if generation != self._generation:
+            return
+        try:
+            if doc.is_closed:
+                return
+            backend.get_rendered_page(doc, page_num, zoom, image_format)
+        except Exception as e:
+            print(f"Advertencia: Falló la precarga de la página {page_num}: {e}")
@@ -1,5 +1,12 @@
+import os
 import re
-import fitz  # PyMuPDF
+import value_index
+import metrics
+
+# Ranking por defecto de search_by_unique_values ("bm25" o "coverage"). Sin
+# variable de entorno se resuelve al buscar (value_index.RANKING_BM25):
+# value_index importa este módulo y aún no está inicializado aquí.
+DEFAULT_RANKING = os.environ.get("CIRCUIT_VERIFIER_RANKING")
 
 try:
     import backend
@@ -22,61 +29,73 @@ def build_flexible_regex(keyword):
     else:
         return re.escape(keyword)
 
-def normalize_text(text):
-    """
-    Limpia y normaliza el texto extraído.
-    """
-    if not text:
-        return ""
-    text = text.replace('\n', ' ').replace('\t', ' ')
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+# Regex para capturar valores (compilada una vez):
+# \d+\.?\d*  -> Número (entero o decimal)
+# \s*        -> Espacio opcional
+# (...)      -> Grupo de unidades comunes en circuitos
+# Nota: Incluimos variaciones comunes.
+COMPONENT_PATTERN = re.compile(
+    r"(\d+\.?\d*)\s*(V|A|Ω|kΩ|mΩ|MΩ|H|mH|µH|F|µF|nF|pF|Hz|kHz|MHz|W|kW)",
+    re.IGNORECASE
+)
 
 def extract_circuit_components(text):
     """
     Extrae valores con unidades eléctricas del texto para verificación.
     Patrón: Número + Espacio(opcional) + Unidad (V, A, Ω, etc.)
+    Retorna cada valor una vez, en orden de aparición. Para conteos y
+    offsets de todo el libro ver component_inventory.
     """
     if not text:
         return []
-        
-    # Regex para capturar valores: 
-    # \d+\.?\d*  -> Número (entero o decimal)
-    # \s*        -> Espacio opcional
-    # (...)      -> Grupo de unidades comunes en circuitos
-    # Nota: Incluimos variaciones comunes.
-    pattern = r"(\d+\.?\d*)\s*(V|A|Ω|kΩ|mΩ|MΩ|H|mH|µH|F|µF|nF|pF|Hz|kHz|MHz|W|kW)"
-    
-    matches = re.findall(pattern, text, re.IGNORECASE)
-    
-    # Formatear resultados como lista de strings "10 kΩ"
-    components = []
-    for val, unit in matches:
-        components.append(f"{val}{unit}")
-        
-    return list(set(components)) # Eliminar duplicados
 
-def calculate_page_score(page_text, compiled_patterns):
+    # Formatear resultados como lista de strings "10 kΩ" (sin duplicados)
+    components = (f"{val}{unit}" for val, unit in COMPONENT_PATTERN.findall(text))
+    return list(dict.fromkeys(components))
+
+class KeywordMatcher:
     """
-    Calcula el score de relevancia de una página basado en coincidencias únicas.
+    Matcher combinado de varias keywords: una sola pasada sobre el texto
+    reporta qué keywords aparecen, con el mismo resultado que hacer un
+    re.search por keyword.
+
+    Las regex de build_flexible_regex se unen en una sola alternancia. Sin
+    grupos con nombre a propósito: así el motor `re` conserva el prefiltro por
+    primer carácter (los valores empiezan por dígito) y salta el texto que no
+    puede iniciar ninguna coincidencia. En cada posición donde la alternancia
+    coincide se verifica qué patrones individuales coinciden ahí (re.match),
+    y la búsqueda continúa en la posición siguiente, de modo que coincidencias
+    solapadas de keywords distintas no se pierden.
+
+    Las keywords vacías o solo espacios se descartan: su regex ("") coincide
+    en todas las posiciones y la pasada recorrería el texto carácter por
+    carácter.
     """
-    if not page_text:
-        return 0.0
-        
-    matches_found = 0
-    total_keywords = len(compiled_patterns)
-    
-    if total_keywords == 0:
-        return 0.0
+    def __init__(self, keywords_list):
+        self.keywords = [k for k in keywords_list if k and k.strip()]
+        self.regex_strings = [build_flexible_regex(k) for k in self.keywords]
+        self.patterns = [re.compile(p, re.IGNORECASE) for p in self.regex_strings]
+        self.combined = re.compile("|".join(self.regex_strings), re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def iter_hits(self, text):
+        """
+        Recorre todas las posiciones donde empieza alguna keyword.
 
-    for pattern in compiled_patterns:
-        if pattern.search(page_text):
-            matches_found += 1
-            
-    score = (matches_found / total_keywords) * 100.0
-    return score
+        Yields:
+            tuple: (posición, lista de índices de keywords que coinciden ahí)
+        """
+        if not self.patterns:
+            return
+        match = self.combined.search(text)
+        while match:
+            pos = match.start()
+            yield pos, [i for i, p in enumerate(self.patterns) if p.match(text, pos)]
+            match = self.combined.search(text, pos + 1)
 
-def search_by_unique_values(doc, keywords_list, page_range=None):
+def search_by_unique_values(doc, keywords_list, page_range=None, workers=None, ranking=None):
     """
     Busca páginas que contengan múltiples valores clave simultáneamente.
     
@@ -85,19 +104,22 @@ def search_by_unique_values(doc, keywords_list, page_range=None):
         keywords_list (list): Lista de strings a buscar (ej: ['10k', '12V']).
         page_range (tuple, optional): (start_page, end_page) indices 0-based. 
                                       Si es None, busca en todo el documento.
+        workers (int, optional): Procesos para el escaneo inicial del documento.
+                                 Por debajo de parallel_scan.PARALLEL_MIN_PAGES
+                                 se escanea en serie.
+        ranking (str, optional): "bm25" (keywords raras pesan más, el % desempata)
+                                 o "coverage" (solo el %). Por defecto DEFAULT_RANKING
+                                 o, sin él, "bm25".
         
     Returns:
         list: Lista de tuplas (page_number, score) ordenada por relevancia.
+              score es el % de keywords presentes en la página.
     """
-    results = []
-    
+    # Keywords vacías ("10V, " desde la UI) no cuentan ni se buscan
+    keywords_list = [k for k in keywords_list or [] if k and k.strip()]
     if not doc or not keywords_list:
         return []
 
-    # 1. Preparar Regexes
-    regex_strings = [build_flexible_regex(k) for k in keywords_list]
-    compiled_patterns = [re.compile(p, re.IGNORECASE) for p in regex_strings]
-    
     # Definir rango de iteración
     start_p = 0
     end_p = doc.page_count
@@ -105,26 +127,16 @@ def search_by_unique_values(doc, keywords_list, page_range=None):
     if page_range:
         start_p = max(0, page_range[0])
         end_p = min(doc.page_count, page_range[1])
-        print(f"Buscando en rango restringido: {start_p} a {end_p}")
-    else:
-        print(f"Buscando en todo el documento: {doc.page_count} páginas")
-    
-    # 2. Iterar sobre páginas
-    for page_num in range(start_p, end_p):
-        try:
-            page = doc.load_page(page_num)
-            raw_text = page.get_text("text")
-            clean_text = normalize_text(raw_text)
-            score = calculate_page_score(clean_text, compiled_patterns)
-            
-            if score > 0:
-                results.append((page_num, score))
-                
-        except Exception as e:
-            print(f"Error procesando página {page_num}: {e}")
-            continue
-
-    results.sort(key=lambda x: x[1], reverse=True)
+
+    # Índice invertido del documento: cada keyword es un posting list y el
+    # score es el conteo de postings por página (% de keywords presentes)
+    index = value_index.get_value_index(doc, workers)
+    ranking = ranking or DEFAULT_RANKING or value_index.RANKING_BM25
+    # Rango buscado: [first_page, first_page + pages)
+    with metrics.timed("regex_scoring", keywords=len(keywords_list), pages=end_p - start_p,
+                       first_page=start_p, ranking=ranking) as event:
+        results = index.score_pages(keywords_list, (start_p, end_p), ranking)
+        event["results"] = len(results)
     return results
 
 if __name__ == "__main__":
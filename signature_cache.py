@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+
+import numpy as np
+
+import page_store
+import metrics
+
+# Firmas de ejercicios ya escaneados, indexadas por hash perceptual
+# (image_shield.perceptual_hash). Junto al índice, un .npz por entrada con
+# sus rasgos de contenido (image_shield.content_features).
+SIGNATURE_CACHE_PATH = os.path.join(page_store.CACHE_DIR, "signatures", "index.json")
+SIGNATURE_CACHE_VERSION = 2 # 2: rasgos de contenido por entrada
+
+# Bits distintos (de 64) para considerar dos fotos como candidatas.
+# Tomas del mismo diagrama quedan en ~0-10; diagramas distintos, sobre ~20.
+# Páginas de puro texto con la misma maquetación también quedan cerca: una
+# candidata solo es acierto si sus rasgos de contenido coinciden
+# (image_shield.CONTENT_MIN_MATCHES).
+SIGNATURE_MAX_DISTANCE = int(os.environ.get("CIRCUIT_VERIFIER_SIGNATURE_DISTANCE", 12))
+SIGNATURE_MAX_ENTRIES = int(os.environ.get("CIRCUIT_VERIFIER_SIGNATURE_MAX_ENTRIES", 5000))
+SIGNATURE_TTL_DAYS = float(os.environ.get("CIRCUIT_VERIFIER_SIGNATURE_TTL_DAYS", 30))
+# Un acierto solo actualiza la fecha de uso en RAM; el índice se reescribe
+# como mucho cada SIGNATURE_SAVE_INTERVAL segundos (y al salir).
+SIGNATURE_SAVE_INTERVAL = 60
+
+def hamming_distance(hash_a, hash_b):
+    """Cantidad de bits distintos entre dos hashes enteros."""
+    return (hash_a ^ hash_b).bit_count()
+
+class SignatureCache:
+    """
+    Caché en disco de firmas (extract_problem_signature) por hash perceptual.
+
+    Una foto casi idéntica a una ya escaneada (otra toma del mismo problema)
+    reutiliza la firma sin llamar al modelo: el pHash elige candidatas y los
+    rasgos de contenido confirman que es el mismo problema. Expulsión LRU
+    por tope de entradas y por antigüedad (TTL desde el último uso).
+    Thread-safe.
+    """
+    def __init__(self, path=SIGNATURE_CACHE_PATH, max_distance=SIGNATURE_MAX_DISTANCE,
+                 max_entries=SIGNATURE_MAX_ENTRIES, ttl_days=SIGNATURE_TTL_DAYS,
+                 save_interval=SIGNATURE_SAVE_INTERVAL):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries = None # hash(int) -> {"signature": [...], "created": t, "used": t}
+        self._dirty = False
+        self._saved_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def lookup(self, image_hash, features):
+        """
+        Busca la firma de la foto más parecida dentro de max_distance cuyos
+        rasgos de contenido coincidan (image_shield.matching_features).
+
+        Args:
+            image_hash (int): Hash de la imagen (image_shield.perceptual_hash).
+            features (tuple): Rasgos de la imagen (image_shield.content_features).
+
+        Returns:
+            tuple: (firma, distancia) o (None, None) si no hay coincidencia.
+        """
+        import image_shield # Import diferido (OpenCV)
+
+        with self._lock:
+            now = time.time()
+            entries = self._load_locked()
+            self._expire_locked(now)
+
+            candidates = []
+            for known_hash, entry in entries.items():
+                distance = hamming_distance(image_hash, known_hash)
+                if distance <= self.max_distance:
+                    candidates.append((distance, known_hash, list(entry["signature"])))
+            candidates.sort() # Más parecida primero
+
+        # Lectura de rasgos y verificación geométrica fuera del lock: no
+        # serializan las búsquedas concurrentes
+        best_hash, best_distance, best_signature = None, None, None
+        rejected = 0
+        for distance, known_hash, signature in candidates:
+            known_features = self._load_features(known_hash)
+            if known_features is not None and \
+                    image_shield.matching_features(features, known_features) >= image_shield.CONTENT_MIN_MATCHES:
+                best_hash, best_distance, best_signature = known_hash, distance, signature
+                break
+            # Misma silueta, otro contenido (ej: páginas de texto con igual maquetación)
+            rejected += 1
+            metrics.incr("signature_cache.rejected")
+
+        with self._lock:
+            self.rejected += rejected
+            if best_hash is None:
+                self.misses += 1
+                metrics.incr("signature_cache.miss")
+                return None, None
+
+            self.hits += 1
+            metrics.incr("signature_cache.hit")
+            entry = self._entries.get(best_hash)
+            if entry is not None: # Pudo expulsarse mientras se verificaba
+                entry["used"] = now
+                self._dirty = True
+                if now - self._saved_at >= self.save_interval:
+                    self._save_locked()
+            return best_signature, best_distance
+
+    def store(self, image_hash, features, signature):
+        """Guarda la firma de una foto y sus rasgos. Las firmas vacías no se cachean."""
+        if not signature:
+            return
+        now = time.time()
+        with self._lock:
+            entries = self._load_locked()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                points, descriptors = features
+                features_path = self._features_path(image_hash)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(features_path), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        np.savez(f, points=points, descriptors=descriptors)
+                    os.replace(tmp_path, features_path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+            except Exception as e:
+                print(f"Advertencia: No se pudieron guardar los rasgos de la foto: {e}")
+                return
+            entries[image_hash] = {"signature": list(signature), "created": now, "used": now}
+            self._expire_locked(now)
+            while len(entries) > self.max_entries:
+                oldest = min(entries, key=lambda h: entries[h]["used"])
+                self._remove_locked(oldest)
+                self.evictions += 1
+            self._save_locked()
+
+    def flush(self):
+        """Persiste las fechas de uso pendientes (se llama también al salir)."""
+        with self._lock:
+            if self._dirty:
+                self._save_locked()
+
+    def clear(self):
+        with self._lock:
+            for known_hash in list(self._load_locked()):
+                self._remove_locked(known_hash)
+            self._save_locked()
+
+    def stats(self):
+        """Contadores de uso de la caché."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._load_locked()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def _expire_locked(self, now):
+        if self.ttl_seconds <= 0:
+            return
+        entries = self._entries
+        expired = [h for h, e in entries.items() if now - e["used"] > self.ttl_seconds]
+        for h in expired:
+            self._remove_locked(h)
+        self.evictions += len(expired)
+
+    def _remove_locked(self, image_hash):
+        del self._entries[image_hash]
+        try:
+            os.remove(self._features_path(image_hash))
+        except OSError:
+            pass
+
+    def _features_path(self, image_hash):
+        return os.path.join(os.path.dirname(self.path), f"{image_hash:016x}.npz")
+
+    def _load_features(self, image_hash):
+        """Rasgos guardados de una entrada; None si faltan o están corruptos."""
+        try:
+            with np.load(self._features_path(image_hash)) as data:
+                return data["points"], data["descriptors"]
+        except Exception:
+            return None
+
+    def _load_locked(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = {}
+        if not os.path.exists(self.path):
+            return self._entries
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") == SIGNATURE_CACHE_VERSION:
+                self._entries = {int(h, 16): e for h, e in payload["entries"].items()}
+        except Exception as e:
+            print(f"Advertencia: Caché de firmas corrupta ({self.path}): {e}")
+        return self._entries
+
+    def _save_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            payload = {
+                "version": SIGNATURE_CACHE_VERSION,
+                "entries": {f"{h:016x}": e for h, e in self._entries.items()},
+            }
+            # Temporal propio: otro proceso (CLI por lotes) puede guardar a la vez
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(payload, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path) # Escritura atómica
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._dirty = False
+            self._saved_at = time.time()
+        except Exception as e:
+            print(f"Advertencia: No se pudo persistir la caché de firmas: {e}")
+
+# Instancia compartida (se preserva si app.py hace importlib.reload)
+if "SIGNATURE_CACHE" not in globals():
+    SIGNATURE_CACHE = SignatureCache()
+    atexit.register(SIGNATURE_CACHE.flush)
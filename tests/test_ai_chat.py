@@ -0,0 +1,64 @@
+import io
+
+import pytest
+from PIL import Image
+
+import ai_chat
+import model_client
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 60), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = model_client.FakeBackend(latency=0.0, jitter=0.0)
+    monkeypatch.setattr(model_client, "_CLIENT", model_client.ModelClient(backend, rate_per_minute=60000, burst=100))
+    return backend
+
+def _images(parts):
+    return [p for p in parts if isinstance(p, Image.Image)]
+
+def test_only_the_latest_page_image_stays_in_history(backend):
+    session = ai_chat.AuditorSession()
+    session.set_page(0, "página uno", _png())
+    ai_chat.send_message(session, "¿Qué hay aquí?")
+    session.set_page(1, "página dos", _png())
+    ai_chat.send_message(session, "¿Y aquí?")
+    ai_chat.send_message(session, "¿Seguro?") # Misma página: sin contexto nuevo
+
+    first, second, third = session._chat.history
+    assert _images(first) == [] and ai_chat.PAGE_IMAGE_OMITTED in first
+    assert len(_images(second)) == 1
+    assert third == ["¿Seguro?"]
+
+def test_page_context_is_resent_after_a_failed_stream(backend, monkeypatch):
+    session = ai_chat.AuditorSession()
+    session.set_page(3, "página cuatro", _png())
+    respond = backend.respond
+
+    def broken_stream(text, stream=False):
+        def chunks():
+            yield model_client.FakeResponse("Respu")
+            raise ConnectionError("stream cortado")
+        return chunks()
+
+    monkeypatch.setattr(backend, "respond", broken_stream)
+    reply = "".join(ai_chat.send_message_stream(session, "hola"))
+    assert "Error de comunicación" in reply
+
+    monkeypatch.setattr(backend, "respond", respond)
+    "".join(ai_chat.send_message_stream(session, "hola otra vez"))
+    assert any("Pág 4" in str(part) for part in session._chat.history[-1])
+
+def test_page_images_are_dropped_from_gemini_history():
+    genai = pytest.importorskip("google.generativeai")
+    chat = genai.GenerativeModel("gemini").start_chat(history=[
+        {"role": "user", "parts": ["contexto", ai_chat.PAGE_IMAGE_NOTE, Image.new("RGB", (8, 8)), "pregunta"]},
+        {"role": "model", "parts": ["respuesta"]},
+    ])
+    ai_chat._drop_page_images(chat)
+    user, model = chat.history
+    assert [part.text for part in user.parts] == ["contexto", ai_chat.PAGE_IMAGE_OMITTED, "pregunta"]
+    assert model.role == "model" and model.parts[0].text == "respuesta"
@@ -0,0 +1,15 @@
+import component_inventory
+
+class _Store:
+    """PageStore mínimo en memoria (sin documento ni caché en disco)."""
+    def __init__(self, pages):
+        self.doc_hash = "test"
+        self.normalized = pages
+        self.page_count = len(pages)
+
+def test_text_components_match_the_book_inventory():
+    pages = ["fuente de 12 V", "R1 = 4k7, R2 = 4.7 kΩ y C1 = 100nF con 12V"]
+    inventory = component_inventory.ComponentInventory.build(_Store(pages))
+
+    for page_number, text in enumerate(pages):
+        assert component_inventory.text_components(text) == inventory.page_components(page_number)
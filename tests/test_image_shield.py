@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import pytest
+
+import image_shield
+
+THRESHOLD = 100.0
+
+def _page(height=4356, width=3366):
+    """
+    Página de libro sintética (tamaño de una foto de celular): líneas de texto
+    negro sobre papel. Debe superar los 3000 px: a ese tamaño el análisis
+    reducido que se usaba antes daba scores no comparables con detect_blur.
+    """
+    rng = np.random.default_rng(0)
+    page = np.full((height, width), 235, np.uint8)
+    for line, top in enumerate(range(200, height - 200, 80)):
+        text = "R1 = 4.7 kOhm, C2 = 100 nF, V = 12 V  " * 3
+        cv2.putText(page, text[line % 7:], (160, top), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.6, 20, 3, cv2.LINE_AA)
+    noise = rng.normal(0, 2, page.shape)
+    return np.clip(page + noise, 0, 255).astype(np.uint8)
+
+def _encode(gray):
+    ok, buffer = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    assert ok
+    return buffer.tobytes()
+
+@pytest.fixture(scope="module")
+def page():
+    return _page()
+
+@pytest.mark.parametrize("sigma", [0, 0.5, 0.8, 1.0, 1.5, 2.0, 3.0])
+def test_all_blur_paths_give_the_full_resolution_score(page, sigma):
+    gray = page if sigma == 0 else cv2.GaussianBlur(page, (0, 0), sigma)
+    image = _encode(gray)
+    decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    expected = cv2.Laplacian(decoded, cv2.CV_64F).var()
+
+    results = [
+        image_shield.detect_blur(image, THRESHOLD),
+        image_shield.detect_blur_batch([image], THRESHOLD)[0],
+        image_shield.ScanImage(image).blur(THRESHOLD),
+    ]
+    for blurry, score in results:
+        assert score == pytest.approx(expected, rel=1e-9)
+        assert blurry == (expected < THRESHOLD)
+
+def test_batch_keeps_order_and_undecodable_images(page):
+    sharp = _encode(page)
+    blurred = _encode(cv2.GaussianBlur(page, (0, 0), 3.0))
+    results = image_shield.detect_blur_batch([blurred, b"no es una imagen", sharp], THRESHOLD, workers=2)
+    assert [blurry for blurry, _ in results] == [True, False, False]
+    assert results[1] == (False, 0.0)
@@ -0,0 +1,58 @@
+import gc
+import threading
+
+import model_client
+
+def _client():
+    backend = model_client.FakeBackend(latency=0.0, jitter=0.0)
+    return model_client.ModelClient(backend, rate_per_minute=60000, burst=100, max_concurrency=1)
+
+def _slot_free(client):
+    if client._slots.acquire(blocking=False):
+        client._slots.release()
+        return True
+    return False
+
+def test_stream_holds_its_slot_until_consumed():
+    client = _client()
+    chat = client.model("fake").start_chat()
+    response = client.call(chat.send_message, ["hola"], stream=True)
+    assert not _slot_free(client) # Los chunks todavía no se leyeron
+
+    chunks = iter(response)
+    first = next(chunks)
+    assert first.text and not _slot_free(client)
+    rest = "".join(chunk.text for chunk in chunks)
+    assert first.text + rest == response.text
+    assert _slot_free(client)
+
+def test_stream_slot_released_on_close_or_discard():
+    client = _client()
+    chat = client.model("fake").start_chat()
+
+    client.call(chat.send_message, ["hola"], stream=True).close()
+    assert _slot_free(client)
+
+    response = client.call(chat.send_message, ["hola"], stream=True)
+    del response
+    gc.collect()
+    assert _slot_free(client)
+
+def test_second_call_waits_for_the_stream():
+    client = _client()
+    chat = client.model("fake").start_chat()
+    response = client.call(chat.send_message, ["hola"], stream=True)
+
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (client.call(chat.send_message, ["otra"]), done.set()))
+    thread.start()
+    assert not done.wait(0.2)
+    list(response)
+    assert done.wait(5)
+    thread.join()
+
+def test_plain_calls_release_the_slot():
+    client = _client()
+    model = client.model("fake")
+    assert client.generate(model, ["firma"]).text
+    assert _slot_free(client)
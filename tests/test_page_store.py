@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import fitz
+import pytest
+
+import page_store
+
+@pytest.fixture
+def book(tmp_path):
+    path = tmp_path / "libro.pdf"
+    doc = fitz.open()
+    for n in range(3):
+        doc.new_page().insert_text((72, 72), f"Página {n}: resistencia de {n}k")
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+def test_sessions_with_separate_documents_extract_the_book_once(book, monkeypatch):
+    # Sin caché en disco ni en RAM: cada sesión tendría que extraer
+    monkeypatch.setattr(page_store, "document_hash", lambda doc: "libro")
+    monkeypatch.setattr(page_store.PageStore, "load", classmethod(lambda cls, doc_hash: None))
+    monkeypatch.setattr(page_store.PageStore, "save", lambda self: None)
+    monkeypatch.setattr(page_store, "_STORES", page_store.OrderedDict())
+
+    extractions = []
+    extract = page_store._extract_raw_pages
+
+    def slow_extract(doc, workers=None):
+        extractions.append(doc)
+        time.sleep(0.2)
+        return extract(doc, workers)
+
+    monkeypatch.setattr(page_store, "_extract_raw_pages", slow_extract)
+    docs = [fitz.open(book) for _ in range(4)]
+    stores = []
+    threads = [threading.Thread(target=lambda d=d: stores.append(page_store.get_page_store(d, workers=1)))
+               for d in docs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(extractions) == 1
+    assert len({id(store) for store in stores}) == 1
+    assert page_store._BUILD_LOCKS == {}
+
+def test_document_lock_belongs_to_the_document(book):
+    first, second = fitz.open(book), fitz.open(book)
+    assert page_store.document_lock(first) is page_store.document_lock(first)
+    assert page_store.document_lock(first) is not page_store.document_lock(second)
+
+def test_page_store_does_not_load_the_search_engine():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import sys, page_store; page_store.PageStore('x', ['a\\n b']); assert 'search_engine' not in sys.modules"
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
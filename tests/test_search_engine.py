@@ -0,0 +1,10 @@
+import search_engine
+
+def test_keyword_matcher_ignores_blank_keywords():
+    matcher = search_engine.KeywordMatcher(["10V", "", "   "])
+    text = "fuente de 10 V " + "relleno sin valores " * 5000 + "y otra de 10V"
+
+    hits = list(matcher.iter_hits(text))
+
+    assert matcher.keywords == ["10V"]
+    assert [indices for _, indices in hits] == [[0], [0]]
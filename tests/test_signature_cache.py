@@ -0,0 +1,88 @@
+import string
+
+import cv2
+import numpy as np
+import pytest
+
+import image_shield
+import signature_cache
+
+def _text_page(seed):
+    """Página de puro texto: misma maquetación para cualquier seed, distinto texto."""
+    layout = np.random.default_rng(0)
+    rng = np.random.default_rng(seed)
+    page = np.full((1100, 850), 235, np.uint8)
+    for line, top in enumerate(range(80, 1040, 34)):
+        length = int(layout.integers(30, 46)) if line % 9 else 12
+        text = "".join(rng.choice(list(string.ascii_lowercase + "      0123456789"), length))
+        cv2.putText(page, text, (60, top), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 20, 2)
+    return page
+
+def _photo(page, seed):
+    """Otra toma de la misma página: giro, escala, desplazamiento, luz y JPEG."""
+    rng = np.random.default_rng(seed)
+    height, width = page.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-2, 2), rng.uniform(0.97, 1.03))
+    matrix[:, 2] += rng.uniform(-15, 15, 2)
+    shot = cv2.warpAffine(page, matrix, (width, height), borderValue=235)
+    shading = np.linspace(0, 40, width)[None, :]
+    shot = np.clip(shot * rng.uniform(0.8, 1) + shading + rng.normal(0, 6, shot.shape), 0, 255)
+    encoded = cv2.imencode(".jpg", shot.astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 70])[1]
+    return cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+
+def _keys(gray):
+    return image_shield.perceptual_hash(gray), image_shield.content_features(gray)
+
+@pytest.fixture
+def cache(tmp_path):
+    return signature_cache.SignatureCache(path=str(tmp_path / "index.json"))
+
+def test_retake_of_the_same_page_hits(cache):
+    page = _text_page(1)
+    cache.store(*_keys(page), ["12V", "4.7k"])
+    for seed in range(4):
+        signature, distance = cache.lookup(*_keys(_photo(page, seed)))
+        assert signature == ["12V", "4.7k"]
+        assert distance <= cache.max_distance
+
+def test_other_text_with_the_same_layout_misses(cache):
+    page = _text_page(1)
+    cache.store(*_keys(page), ["12V", "4.7k"])
+    for seed in range(2, 6):
+        other = _photo(_text_page(seed), seed)
+        assert cache.lookup(*_keys(other)) == (None, None)
+    # Varias quedan dentro de max_distance por pHash: las descartan los rasgos
+    assert cache.stats()["rejected"] >= 2
+
+def test_features_are_removed_with_their_entry(cache, tmp_path):
+    cache.max_entries = 1
+    cache.store(*_keys(_text_page(1)), ["12V"])
+    cache.store(*_keys(_text_page(2)), ["5V"])
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    cache.clear()
+    assert list(tmp_path.glob("*.npz")) == []
+
+def test_hits_are_persisted_in_batches(cache, monkeypatch):
+    page = _text_page(1)
+    cache.store(*_keys(page), ["12V"])
+    saves = []
+    monkeypatch.setattr(cache, "_save_locked", lambda: saves.append(1))
+    for _ in range(20):
+        assert cache.lookup(*_keys(page))[0] == ["12V"]
+    assert saves == [] # Solo fechas de uso: se guardan al cumplirse el intervalo
+    cache.flush()
+    assert saves == [1]
+
+def test_content_check_runs_outside_the_lock(cache, monkeypatch):
+    page = _text_page(1)
+    cache.store(*_keys(page), ["12V"])
+    matching_features = image_shield.matching_features
+    locked = []
+
+    def check(a, b):
+        locked.append(cache._lock.locked())
+        return matching_features(a, b)
+
+    monkeypatch.setattr(image_shield, "matching_features", check)
+    assert cache.lookup(*_keys(_photo(page, 0)))[0] == ["12V"]
+    assert locked == [False]
@@ -0,0 +1,81 @@
+import pytest
+
+import units
+
+OMEGA = "\u03a9" # Letra griega
+OHM_SIGN = "\u2126" # Signo de ohm (texto extraído de PDF)
+
+@pytest.mark.parametrize("token, expected", [
+    ("10k", (10000.0, OMEGA)),
+    (f"10 k{OMEGA}", (10000.0, OMEGA)),
+    (f"10 k{OHM_SIGN}", (10000.0, OMEGA)),
+    (f"10k{OHM_SIGN}", (10000.0, OMEGA)),
+    ("10 kohm", (10000.0, OMEGA)),
+    (f"10,000 {OMEGA}", (10000.0, OMEGA)),
+    ("10K0", (10000.0, OMEGA)),
+    ("4k7", (4700.0, OMEGA)),
+    (f"4k7{OHM_SIGN}", (4700.0, OMEGA)),
+    ("2R2", (2.2, OMEGA)),
+    ("1M5", (1500000.0, OMEGA)),
+    (f"4,7 k{OMEGA}", (4700.0, OMEGA)),
+    ("4.7µF", (4.7e-06, "F")),
+    ("4.7μF", (4.7e-06, "F")), # mu griega
+    ("100 nF", (1e-07, "F")),
+    ("0.1µF", (1e-07, "F")),
+    ("12V", (12.0, "V")),
+    ("3.3mH", (0.0033, "H")),
+    ("2.2 MHz", (2200000.0, "Hz")),
+    ("1.5 kW", (1500.0, "W")),
+])
+def test_parse_value(token, expected):
+    assert units.parse_value(token) == expected
+
+@pytest.mark.parametrize("token", ["10", "abc", "Vx", "", "10x"])
+def test_parse_value_rejects_non_values(token):
+    assert units.parse_value(token) is None
+
+def test_find_values_positions_and_guards():
+    text = f"R1 = 4k7, R2 de 10,000 {OHM_SIGN} y C = 100 nF; x10k y la 10a sección"
+    found = list(units.find_values(text))
+    assert [(v, u) for v, u, _, _ in found] == [(4700.0, OMEGA), (10000.0, OMEGA), (1e-07, "F")]
+    value, unit, start, end = found[1]
+    assert text[start:end] == f"10,000 {OHM_SIGN}"
+
+def test_find_values_ohm_sign():
+    assert list(units.find_values(f"R = 10 k{OHM_SIGN}")) == [(10000.0, OMEGA, 4, 9)]
+
+@pytest.mark.parametrize("keyword, expected", [
+    ("4.5k-5k", (OMEGA, 4500.0, 5000.0)),
+    ("4.5-5k", (OMEGA, 4500.0, 5000.0)),
+    ("4.5k..5k", (OMEGA, 4500.0, 5000.0)),
+    (f"4.5k{OHM_SIGN}-5k{OHM_SIGN}", (OMEGA, 4500.0, 5000.0)),
+    ("5k-4.5k", (OMEGA, 4500.0, 5000.0)),
+])
+def test_parse_query_ranges(keyword, expected):
+    assert units.parse_query(keyword) == expected
+
+def test_parse_query_tolerance():
+    unit, low, high = units.parse_query("100nF±10%")
+    assert unit == "F"
+    assert low == pytest.approx(90e-9)
+    assert high == pytest.approx(110e-9)
+    assert units.parse_query("100nF+-10%") == (unit, low, high)
+
+def test_parse_query_exact_value():
+    unit, low, high = units.parse_query("10k")
+    assert unit == OMEGA
+    assert low < 10000.0 < high
+    assert high - low < 1e-3
+
+@pytest.mark.parametrize("keyword", ["abc", "10k-12V", "R3"])
+def test_parse_query_rejects(keyword):
+    assert units.parse_query(keyword) is None
+
+@pytest.mark.parametrize("value, unit, expected", [
+    (4700.0, OMEGA, f"4.7k{OMEGA}"),
+    (1e-07, "F", "100nF"),
+    (0.0033, "H", "3.3mH"),
+    (0.0, "V", "0V"),
+])
+def test_format_value(value, unit, expected):
+    assert units.format_value(value, unit) == expected
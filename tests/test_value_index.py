@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+import component_inventory
+import search_engine
+import value_index
+
+class _Store:
+    """PageStore mínimo en memoria (sin documento ni caché en disco)."""
+    def __init__(self, pages):
+        self.doc_hash = "test"
+        self.normalized = pages
+        self.page_count = len(pages)
+
+@pytest.fixture
+def index(monkeypatch):
+    # Sin persistir el inventario en la caché del repositorio
+    monkeypatch.setattr(component_inventory, "get_store_inventory", component_inventory.ComponentInventory.build)
+    pages = [f"resistencia de {n}k en serie con {n % 7 + 1}v y {n % 5 + 1}00nf" for n in range(1, 200)]
+    pages[41] += " fuente de 12v y 4.7k"
+    return value_index.ValueIndex(_Store(pages))
+
+def test_score_pages_finds_numeric_and_text_matches(index):
+    results = index.score_pages(["12v", "4.7k"])
+    assert results[0] == (41, 100.0)
+
+def test_concurrent_searches_share_the_lazy_caches(index):
+    keywords = [[f"{n}k", f"{n % 7 + 1}v", "fuente"] for n in range(1, 60)]
+    expected = index.score_pages(keywords[0])
+    index._keyword_entries.clear()
+    index._value_postings.clear()
+
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def search():
+        barrier.wait()
+        try:
+            for keywords_list in keywords:
+                index.score_pages(keywords_list, ranking=value_index.RANKING_BM25)
+                index.bm25_scores(keywords_list)
+        except Exception as e: # KeyError si se ve una caché a medio llenar
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert index.score_pages(keywords[0]) == expected
+    pages, freqs = index._keyword_entry("fuente")
+    assert len(pages) == len(freqs) and np.array_equal(pages, [41])
+
+def test_blank_keywords_match_no_page(index):
+    assert len(index.keyword_postings("  ")) == 0
+    assert index.score_pages(["12v", ""])[0] == (41, 50.0)
+
+def test_value_index_imports_on_its_own():
+    # Sin importar search_engine antes (importación circular)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", "import value_index"], cwd=root,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_new_keywords_are_scanned_outside_the_lock(index, monkeypatch):
+    iter_hits = search_engine.KeywordMatcher.iter_hits
+    locked = []
+
+    def scan(matcher, text):
+        locked.append(index._lock.locked())
+        return iter_hits(matcher, text)
+
+    monkeypatch.setattr(search_engine.KeywordMatcher, "iter_hits", scan)
+    assert index.score_pages(["fuente"])[0] == (41, 100.0)
+    assert locked == [False]
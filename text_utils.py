@@ -0,0 +1,14 @@
+import re
+
+# Sin dependencias del resto de la app: page_store, search_engine y la UI
+# normalizan el texto igual sin importarse entre sí.
+
+def normalize_text(text):
+    """
+    Limpia y normaliza el texto extraído.
+    """
+    if not text:
+        return ""
+    text = text.replace('\n', ' ').replace('\t', ' ')
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
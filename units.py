@@ -0,0 +1,161 @@
+import re
+import math
+
+# Prefijos SI (distingue m = mili de M = mega; k y K son kilo)
+SI_PREFIXES = {
+    "p": 1e-12, "n": 1e-9, "u": 1e-6, "µ": 1e-6, "μ": 1e-6,
+    "m": 1e-3, "k": 1e3, "K": 1e3, "M": 1e6, "G": 1e9,
+}
+
+# Formas de escribir ohm: omega griega (U+03A9), signo de ohm (U+2126,
+# frecuente en texto extraído de PDF), omega minúscula y en palabras
+OHM_ALIASES = ["\u03a9", "\u2126", "\u03c9", "ohm", "ohms", "Ohm", "Ohms", "OHM", "OHMS"]
+
+# Variantes escritas de cada unidad -> unidad canónica
+UNIT_ALIASES = {
+    **{alias: "Ω" for alias in OHM_ALIASES},
+    "V": "V", "v": "V", "A": "A", "H": "H", "F": "F", "W": "W",
+    "Hz": "Hz", "hz": "Hz", "HZ": "Hz",
+}
+BASE_UNITS = ["V", "A", "Ω", "H", "F", "Hz", "W"]
+
+# Sin unidad, un valor con prefijo ("10k", "4k7", "1M") es una resistencia
+DEFAULT_UNIT = "Ω"
+
+# Tolerancia relativa al comparar valores "iguales" (errores de coma flotante)
+EXACT_TOLERANCE = 1e-9
+
+def _alternation(aliases):
+    """Alternancia regex con las variantes más largas primero."""
+    return "|".join(sorted((re.escape(a) for a in aliases), key=len, reverse=True))
+
+_UNIT_ALT = _alternation(UNIT_ALIASES)
+_PREFIX_CLASS = "[" + "".join(SI_PREFIXES) + "]"
+
+# Número: con separador de miles (10,000 / 1,000,000.5) o decimal con . o ,
+_NUMBER = r"(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?)"
+
+# Valor con unidad: 10 kΩ, 4.7µF, 10,000 Ω, 12V, 100 kohm
+_WITH_UNIT = (
+    _NUMBER + r"\s?(?P<prefix>" + _PREFIX_CLASS + r")?(?P<unit>" + _UNIT_ALT + r")"
+)
+# Notación RKM: el prefijo hace de punto decimal (4k7, 2R2, 10K0, 1M5)
+_RKM = (
+    r"(?P<rkm_int>\d+)(?P<rkm_prefix>[RkKM])(?P<rkm_frac>\d+)(?:\s?(?P<rkm_unit>" + _alternation(OHM_ALIASES) + r"))?"
+)
+# Solo prefijo, pegado al número: 10k, 4.7K, 1M (resistencias)
+_BARE = r"(?P<bare_number>\d+(?:\.\d+)?)(?P<bare_prefix>[kKM])"
+
+VALUE_PATTERN = re.compile(
+    r"(?<![\w.,])(?:" + _RKM + "|" + _WITH_UNIT + "|" + _BARE + r")(?![A-Za-z0-9])"
+)
+
+def _parse_number(text):
+    """'10,000' -> 10000.0; '4,7' -> 4.7 (coma decimal); '4.7' -> 4.7."""
+    if re.fullmatch(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?", text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+def _round_si(value):
+    """12 cifras significativas: '100 nF' y '0.1 µF' dan exactamente el mismo float."""
+    return float(f"{value:.12g}")
+
+def _from_match(match):
+    """(valor_SI, unidad) de un match de VALUE_PATTERN."""
+    if match.group("rkm_int") is not None:
+        prefix = match.group("rkm_prefix")
+        number = float(f"{match.group('rkm_int')}.{match.group('rkm_frac')}")
+        scale = 1.0 if prefix == "R" else SI_PREFIXES[prefix]
+        return _round_si(number * scale), DEFAULT_UNIT
+    if match.group("number") is not None:
+        number = _parse_number(match.group("number"))
+        prefix = match.group("prefix")
+        scale = SI_PREFIXES[prefix] if prefix else 1.0
+        return _round_si(number * scale), UNIT_ALIASES[match.group("unit")]
+    number = float(match.group("bare_number"))
+    return _round_si(number * SI_PREFIXES[match.group("bare_prefix")]), DEFAULT_UNIT
+
+def find_values(text):
+    """
+    Todos los valores con unidad de un texto.
+
+    Yields:
+        tuple: (valor_SI, unidad_canónica, inicio, fin) en orden de aparición.
+               Ej: '4k7' -> (4700.0, 'Ω', ...), '100 nF' -> (1e-07, 'F', ...).
+    """
+    if not text:
+        return
+    for match in VALUE_PATTERN.finditer(text):
+        value, unit = _from_match(match)
+        yield value, unit, match.start(), match.end()
+
+def parse_value(token):
+    """
+    Convierte un valor escrito a (valor_SI, unidad_canónica).
+
+    Acepta las salidas de search_engine.extract_circuit_components ('10kΩ'),
+    notación RKM ('4k7'), prefijo sin unidad ('10k' = 10 kΩ), separador de
+    miles ('10,000 Ω') y variantes de ohm ('10 kohm').
+
+    Returns:
+        tuple: (float, str) o None si el token no es un valor con unidad.
+    """
+    if not token:
+        return None
+    token = token.strip()
+    match = VALUE_PATTERN.fullmatch(token)
+    if match is None:
+        return None
+    return _from_match(match)
+
+def parse_query(keyword):
+    """
+    Interpreta una keyword como consulta numérica.
+
+    Formatos:
+        '10k'             -> valor exacto (10 kΩ)
+        '4.5k-5k'         -> rango (también '4.5k..5k')
+        '100nF±10%'       -> tolerancia (también '100nF+-10%')
+
+    Returns:
+        tuple: (unidad, mínimo, máximo) en unidades SI, o None.
+    """
+    keyword = keyword.strip().replace(" ", "")
+    tolerance = re.fullmatch(r"(.+?)(?:±|\+-|\+/-)(\d+(?:\.\d+)?)%", keyword)
+    if tolerance:
+        parsed = parse_value(tolerance.group(1))
+        if parsed is None:
+            return None
+        value, unit = parsed
+        fraction = float(tolerance.group(2)) / 100.0
+        return unit, value * (1 - fraction), value * (1 + fraction)
+
+    span = re.fullmatch(r"(.+?)(?:\.\.|-)(.+)", keyword)
+    if span:
+        low_token, high_token = span.groups()
+        high = parse_value(high_token)
+        # '4.5-5k': el extremo sin prefijo/unidad toma los del otro extremo
+        low = parse_value(low_token)
+        if high is not None and low is None and re.fullmatch(r"\d+(?:\.\d+)?", low_token):
+            suffix = re.sub(r"^[\d.,]+", "", high_token)
+            low = parse_value(low_token + suffix)
+        if low is not None and high is not None and low[1] == high[1]:
+            return low[1], min(low[0], high[0]), max(low[0], high[0])
+        return None
+
+    parsed = parse_value(keyword)
+    if parsed is None:
+        return None
+    value, unit = parsed
+    margin = abs(value) * EXACT_TOLERANCE
+    return unit, value - margin, value + margin
+
+def format_value(value, unit):
+    """Valor SI en notación de ingeniería: (4700.0, 'Ω') -> '4.7kΩ'."""
+    if value == 0:
+        return f"0{unit}"
+    exponent = int(math.floor(math.log10(abs(value)) / 3) * 3)
+    exponent = max(-12, min(9, exponent))
+    prefixes = {-12: "p", -9: "n", -6: "µ", -3: "m", 0: "", 3: "k", 6: "M", 9: "G"}
+    mantissa = value / (10 ** exponent)
+    return f"{mantissa:.4g}{prefixes[exponent]}{unit}"
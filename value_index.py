@@ -0,0 +1,302 @@
+import bisect
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import page_store
+import search_engine
+import units
+import component_inventory
+
+# Separador entre páginas en el texto concatenado. Ningún patrón de
+# build_flexible_regex puede coincidir con él (\s no incluye \x00), así que
+# una coincidencia nunca cruza de una página a otra.
+PAGE_SEPARATOR = "\x00"
+
+MAX_INDEXES_IN_MEMORY = 4
+
+# Parámetros BM25: k1 satura la frecuencia de un término en la página,
+# b controla cuánto penaliza una página larga (0 = nada, 1 = proporcional)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Modos de ranking de score_pages
+RANKING_COVERAGE = "coverage" # % de keywords presentes en la página
+RANKING_BM25 = "bm25" # Keywords ponderadas por rareza (IDF) y frecuencia
+RANKING_MODES = (RANKING_COVERAGE, RANKING_BM25)
+
+if "_INDEXES" not in globals():
+    _INDEXES = OrderedDict()
+if "_INDEX_LOCK" not in globals():
+    _INDEX_LOCK = threading.Lock()
+
+class ValueIndex:
+    """
+    Índice invertido de valores de circuito de un documento.
+
+    - Postings por keyword: páginas donde coincide build_flexible_regex(keyword),
+      resueltas en una pasada sobre el libro concatenado y memorizadas (una
+      keyword está en la página si su regex coincide en el texto normalizado).
+    - Valores numéricos: cada valor del libro como (valor SI, unidad) del
+      inventario de componentes ('10 kΩ', '10,000 Ω', '10K0' y '4k7' quedan
+      en la misma escala), en una matriz dispersa página×término por unidad
+      (formato CSC: una columna por valor distinto, ordenadas por valor).
+      Las consultas exactas, de rango y de tolerancia son dos búsquedas
+      binarias (np.searchsorted) que delimitan un bloque de columnas, en
+      lugar de un escaneo con regex.
+
+    Un mismo índice lo comparten todas las sesiones que abren el libro: las
+    cachés de postings se calculan fuera de self._lock y se publican bajo él.
+    """
+    def __init__(self, store):
+        self.doc_hash = store.doc_hash
+        self.page_count = store.page_count
+
+        # Texto concatenado + offsets de inicio de cada página
+        self._page_starts = []
+        offset = 0
+        for text in store.normalized:
+            self._page_starts.append(offset)
+            offset += len(text) + len(PAGE_SEPARATOR)
+        self._joined = PAGE_SEPARATOR.join(store.normalized)
+
+        # Largo de cada página en palabras (normalización de BM25)
+        self.page_lengths = np.array([len(text.split()) for text in store.normalized], dtype=np.float64)
+
+        self._build_term_matrix(component_inventory.get_store_inventory(store))
+        self._lock = threading.Lock()
+        self._keyword_entries = {} # regex -> (páginas, apariciones por página)
+        self._value_postings = {}
+
+    def _build_term_matrix(self, inventory):
+        """
+        Matriz página×término por unidad, a partir del inventario de componentes
+        (ya tiene una fila por valor y página con su número de apariciones):
+            term_values[unit]: valores distintos ordenados (una columna cada uno)
+            term_ptr[unit]:    inicio de cada columna en term_pages/term_freqs
+            term_pages[unit]:  páginas de la columna (ascendentes)
+            term_freqs[unit]:  apariciones del valor en esa página
+        """
+        self.term_values = {}
+        self.term_ptr = {}
+        self.term_pages = {}
+        self.term_freqs = {}
+        for unit in units.BASE_UNITS:
+            values, pages, freqs = inventory.unit_rows(unit)
+            if len(values) == 0:
+                continue
+            # Por valor y, dentro de un valor, páginas ascendentes
+            order = np.lexsort((pages, values))
+            values = values[order]
+            self.term_pages[unit] = pages[order]
+            self.term_freqs[unit] = freqs[order]
+
+            # Una columna por valor distinto
+            new_term = np.ones(len(values), dtype=bool)
+            new_term[1:] = values[1:] != values[:-1]
+            term_starts = np.flatnonzero(new_term)
+            self.term_values[unit] = values[term_starts]
+            self.term_ptr[unit] = np.append(term_starts, len(values))
+
+    def _range_entries(self, unit, low, high):
+        """Entradas (páginas, frecuencias) de las columnas con valor en [low, high]."""
+        term_values = self.term_values.get(unit)
+        if term_values is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        ptr = self.term_ptr[unit]
+        first = ptr[np.searchsorted(term_values, low, side="left")]
+        last = ptr[np.searchsorted(term_values, high, side="right")]
+        return self.term_pages[unit][first:last], self.term_freqs[unit][first:last]
+
+    def pages_in_range(self, unit, low, high):
+        """
+        Páginas con algún valor de la unidad dentro de [low, high] (unidades SI).
+
+        Returns:
+            np.ndarray: Índices de página (int32, ordenados, sin duplicados).
+        """
+        pages, _ = self._range_entries(unit, low, high)
+        return np.unique(pages)
+
+    def value_postings(self, keyword):
+        """
+        Páginas que cumplen la keyword como consulta numérica
+        ('10k', '4.5k-5k', '100nF±10%', ver units.parse_query).
+
+        Returns:
+            np.ndarray: Índices de página; vacío si la keyword no es numérica.
+        """
+        pages = self._value_postings.get(keyword)
+        if pages is None:
+            query = units.parse_query(keyword)
+            if query is None:
+                pages = np.empty(0, dtype=np.int32)
+            else:
+                pages = self.pages_in_range(*query)
+            with self._lock:
+                pages = self._value_postings.setdefault(keyword, pages)
+        return pages
+
+    def keyword_frequencies(self, keyword):
+        """
+        Fila de la keyword en la matriz de consulta: apariciones por página.
+        Por página se toma el mayor entre las coincidencias de la regex
+        flexible y los valores numéricos (son las mismas apariciones vistas
+        de dos formas, no se suman).
+
+        Returns:
+            np.ndarray: Vector denso (float64) de largo page_count.
+        """
+        freqs = np.zeros(self.page_count, dtype=np.float64)
+        pages, page_freqs = self._keyword_entry(keyword)
+        freqs[pages] = page_freqs
+        query = units.parse_query(keyword)
+        if query is not None:
+            value_pages, value_freqs = self._range_entries(*query)
+            numeric = np.bincount(value_pages, weights=value_freqs, minlength=self.page_count)
+            np.maximum(freqs, numeric, out=freqs)
+        return freqs
+
+    def keyword_postings(self, keyword):
+        """
+        Páginas donde coincide la regex flexible de la keyword.
+
+        Returns:
+            np.ndarray: Índices de página (int32, ordenados, sin duplicados).
+        """
+        return self._keyword_entry(keyword)[0]
+
+    def _keyword_entry(self, keyword):
+        """(páginas, apariciones por página) de la regex flexible de la keyword."""
+        regex_string = search_engine.build_flexible_regex(keyword)
+        if not regex_string:
+            # Keyword en blanco: no coincide en ninguna página
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        entry = self._keyword_entries.get(regex_string)
+        if entry is None:
+            self._resolve_postings([keyword])
+            entry = self._keyword_entries[regex_string]
+        return entry
+
+    def _resolve_postings(self, keywords_list):
+        """
+        Calcula los postings de varias keywords nuevas en una sola pasada
+        sobre el libro concatenado (search_engine.KeywordMatcher).
+
+        El escaneo corre fuera de self._lock (no bloquea las búsquedas de
+        otras sesiones); bajo el lock solo se publican los resultados. Si dos
+        sesiones escanean a la vez por la misma keyword, queda el primero.
+        """
+        pending = {}
+        for keyword in keywords_list:
+            regex_string = search_engine.build_flexible_regex(keyword)
+            if regex_string and regex_string not in self._keyword_entries:
+                pending.setdefault(regex_string, keyword)
+        if not pending:
+            return
+
+        matcher = search_engine.KeywordMatcher(list(pending.values()))
+        pages = [[] for _ in matcher.patterns]
+        freqs = [[] for _ in matcher.patterns]
+        for pos, hit_indices in matcher.iter_hits(self._joined):
+            page_num = bisect.bisect_right(self._page_starts, pos) - 1
+            for i in hit_indices:
+                if not pages[i] or pages[i][-1] != page_num:
+                    pages[i].append(page_num)
+                    freqs[i].append(1)
+                else:
+                    freqs[i][-1] += 1
+
+        with self._lock:
+            for regex_string, page_list, freq_list in zip(matcher.regex_strings, pages, freqs):
+                # Páginas y frecuencias juntas: nunca se ve una sin la otra
+                self._keyword_entries.setdefault(regex_string, (
+                    np.array(page_list, dtype=np.int32), np.array(freq_list, dtype=np.int32)))
+
+    def bm25_scores(self, keywords_list):
+        """
+        Score BM25 de todas las páginas en una operación vectorizada sobre
+        la matriz keywords×páginas. Una keyword presente en pocas páginas
+        (3.3mH) pesa más que una presente en casi todas (1A).
+
+        Returns:
+            np.ndarray: Score por página (float64, largo page_count).
+        """
+        freqs = np.vstack([self.keyword_frequencies(k) for k in keywords_list])
+        doc_freq = np.count_nonzero(freqs, axis=1)
+        idf = np.log1p((self.page_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        average_length = self.page_lengths.mean() or 1.0
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.page_lengths / average_length)
+        saturated = freqs * (BM25_K1 + 1) / (freqs + length_norm)
+        return idf @ saturated
+
+    def score_pages(self, keywords_list, page_range=None, ranking=RANKING_COVERAGE):
+        """
+        Score de todas las páginas vía intersección/conteo de postings.
+
+        Args:
+            keywords_list (list): Keywords a buscar (ej: ['10k', '12V']).
+            page_range (tuple, optional): (start_page, end_page) 0-based.
+            ranking (str): RANKING_COVERAGE ordena por % de keywords presentes;
+                           RANKING_BM25 ordena por bm25_scores y usa el % como
+                           desempate.
+
+        Returns:
+            list: Tuplas (page_number, score) ordenadas por relevancia, donde
+                  score es siempre el % de keywords presentes. Una keyword
+                  cuenta en la página si coincide su regex flexible o su
+                  valor numérico.
+        """
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Modo de ranking desconocido: {ranking}")
+        total_keywords = len(keywords_list)
+        if total_keywords == 0 or self.page_count == 0:
+            return []
+
+        self._resolve_postings(keywords_list)
+        postings = [np.union1d(self.keyword_postings(k), self.value_postings(k)) for k in keywords_list]
+        counts = np.bincount(np.concatenate(postings), minlength=self.page_count)
+
+        start_p, end_p = 0, self.page_count
+        if page_range:
+            start_p, end_p = page_range
+        pages = np.nonzero(counts[start_p:end_p])[0] + start_p
+
+        if ranking == RANKING_BM25:
+            # Redondeo: diferencias de coma flotante no deben saltarse el desempate
+            relevance = np.round(self.bm25_scores(keywords_list)[pages], 9)
+            order = np.lexsort((pages, -counts[pages], -relevance))
+        else:
+            # Orden estable: mismo desempate (página ascendente) que list.sort
+            order = np.argsort(-counts[pages], kind="stable")
+        return [(int(p), (int(counts[p]) / total_keywords) * 100.0) for p in pages[order]]
+
+def get_value_index(doc, workers=None):
+    """
+    Obtiene (o construye) el índice invertido del documento.
+
+    Args:
+        doc (fitz.Document): Documento cargado.
+        workers (int, optional): Procesos para extraer el texto si aún no está en caché.
+
+    Returns:
+        ValueIndex: Índice del documento.
+    """
+    doc_hash = page_store.document_hash(doc)
+    with _INDEX_LOCK:
+        index = _INDEXES.get(doc_hash)
+        if index is not None:
+            _INDEXES.move_to_end(doc_hash)
+            return index
+
+    # Construcción fuera del lock: no bloquea las búsquedas en otros libros
+    index = ValueIndex(page_store.get_page_store(doc, workers))
+    with _INDEX_LOCK:
+        # Si otro hilo lo construyó mientras tanto, todos usan el mismo
+        index = _INDEXES.setdefault(doc_hash, index)
+        _INDEXES.move_to_end(doc_hash)
+        while len(_INDEXES) > MAX_INDEXES_IN_MEMORY:
+            _INDEXES.popitem(last=False)
+    return index